@@ -3,15 +3,16 @@ import time, datetime
 from pprint import pprint
 
 from PyQt6.QtGui import QTextCursor, QFont
-from PyQt6.QtCore import pyqtSignal
+from PyQt6.QtCore import pyqtSignal, QThread, Qt
 from PyQt6.QtWidgets import QApplication, QWidget, QLabel, QPushButton, QVBoxLayout, QTextEdit, QCheckBox, QHBoxLayout, \
-    QDialog, QSpinBox
+    QDialog, QSpinBox, QLineEdit, QTableWidget, QTableWidgetItem, QProgressBar, QHeaderView
 from icecream import ic
 
 from scanner import PreScaner
 from ip_addr_widget import IPAddressWidget, SystemNameWidget
 
 from ping_widget import PingWidget
+from discovery import discover, parse_networks, system_name_for
 
 
 # from global_data import global_data
@@ -189,6 +190,144 @@ class EditSystemDialog(AddSystemDialog):
         self.ip_widget.validate_ip()
 
 
+class DiscoveryThread(QThread):
+    """Runs discovery.discover out of GUI thread"""
+    found = pyqtSignal(dict)
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, networks, broadcast=True, unicast=True):
+        super().__init__()
+        self.networks = networks
+        self.broadcast = broadcast
+        self.unicast = unicast
+
+    def run(self):
+        discover(self.networks, broadcast=self.broadcast, unicast=self.unicast,
+                 found=self.found.emit, progress=self.progress.emit, stopped=self.isInterruptionRequested)
+
+
+class DiscoveryDialog(QDialog):
+    """Finds EtherNet/IP modules by ListIdentity over given subnets and offers them as new systems"""
+
+    data_ready = pyqtSignal(str, str, bool)  # Arguments for SystemName, IP, deep scan
+    columns = ('', 'ip', 'product_name', 'product_type', 'vendor', 'serial', 'rev')
+
+    def __init__(self, parent=None, system_names_defined=[], entry_points_defined=[]):
+        super().__init__(parent)
+        self.setWindowTitle("Discover entry points")
+        self.resize(800, 500)
+        self.system_names_defined = list(system_names_defined)
+        self.entry_points_defined = set(entry_points_defined)
+        self.worker = None
+        self.responders = []
+
+        self.networks_input = QLineEdit()
+        self.networks_input.setPlaceholderText("Subnets, like 10.10.0.0/22 192.168.1.0/24")
+        self.broadcast_checkbox = QCheckBox('Broadcast')
+        self.broadcast_checkbox.setChecked(True)
+        self.unicast_checkbox = QCheckBox('Sweep every address')
+        self.unicast_checkbox.setChecked(True)
+        self.deep_scan_checkbox = QCheckBox('Deep scan')
+        self.button_discover = QPushButton("Discover")
+        self.button_discover.clicked.connect(self.start_discovery)
+        self.progress_bar = QProgressBar()
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.status_label = QLabel("")
+        self.button_cancel = QPushButton("Cancel")
+        self.button_cancel.clicked.connect(self.reject)
+        self.button_add = QPushButton("Add checked")
+        self.button_add.clicked.connect(self.accept)
+
+        networks_layout = QHBoxLayout()
+        networks_layout.addWidget(QLabel("Subnets:"))
+        networks_layout.addWidget(self.networks_input, stretch=1)
+        networks_layout.addWidget(self.broadcast_checkbox)
+        networks_layout.addWidget(self.unicast_checkbox)
+        networks_layout.addWidget(self.button_discover)
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.deep_scan_checkbox)
+        button_layout.addWidget(self.status_label, stretch=1)
+        button_layout.addWidget(self.button_cancel)
+        button_layout.addWidget(self.button_add)
+
+        main_layout = QVBoxLayout()
+        main_layout.addLayout(networks_layout)
+        main_layout.addWidget(self.progress_bar)
+        main_layout.addWidget(self.table)
+        main_layout.addLayout(button_layout)
+        self.setLayout(main_layout)
+
+    def start_discovery(self):
+        try:
+            networks = parse_networks(self.networks_input.text())
+        except ValueError as e:
+            self.status_label.setText(f"Wrong subnet: {e}")
+            return
+        if not networks:
+            self.status_label.setText("Enter subnets to discover")
+            return
+        self.button_discover.setEnabled(False)
+        self.status_label.setText("Discovering...")
+        self.started_at = time.time()
+        self.worker = DiscoveryThread(networks,
+                                      broadcast=self.broadcast_checkbox.isChecked(),
+                                      unicast=self.unicast_checkbox.isChecked())
+        self.worker.found.connect(self.add_responder)
+        self.worker.progress.connect(self.update_progress)
+        self.worker.finished.connect(self.discovery_finished)
+        self.worker.start()
+
+    def update_progress(self, sent: int, total: int):
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(sent)
+
+    def add_responder(self, identity: dict):
+        if any(responder['ip'] == identity['ip'] for responder in self.responders):
+            return  # found by earlier discovery
+        self.responders.append(identity)
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        check = QTableWidgetItem()
+        known = identity['ip'] in self.entry_points_defined
+        check.setCheckState(Qt.CheckState.Unchecked if known else Qt.CheckState.Checked)
+        if known:
+            check.setToolTip("Entry point is defined already")
+        self.table.setItem(row, 0, check)
+        for column, name in enumerate(self.columns[1:], start=1):
+            self.table.setItem(row, column, QTableWidgetItem(str(identity.get(name, ''))))
+
+    def discovery_finished(self):
+        self.button_discover.setEnabled(True)
+        self.status_label.setText(f"{len(self.responders)} modules answered "
+                                  f"in {time.time() - self.started_at:.1f} s")
+
+    def accept(self):
+        deep_scan = self.deep_scan_checkbox.isChecked()
+        for row, identity in enumerate(self.responders):
+            if self.table.item(row, 0).checkState() != Qt.CheckState.Checked:
+                continue
+            system_name = system_name_for(identity)
+            if system_name in self.system_names_defined:
+                continue
+            self.system_names_defined.append(system_name)
+            self.data_ready.emit(system_name, identity['ip'], deep_scan)
+        self.stop_discovery()
+        super().accept()
+
+    def reject(self):
+        self.stop_discovery()
+        super().reject()
+
+    def stop_discovery(self):
+        """Discovery thread must not outlive the dialog: it is stopped and waited for"""
+        if self.worker is not None:
+            self.worker.requestInterruption()
+            self.worker.wait()
+
+
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = AddSystemDialog()
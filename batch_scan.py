@@ -0,0 +1,112 @@
+"""
+Headless batch scanner. No display needed, so it can be scheduled on a server.
+
+Scans the systems from the job list main_prog saves (main_prog.cfg) or from a CSV file
+in the format IRT_SettingsImporter reads, in a pool of processes.
+Writes the same .data files as the GUI.
+
+    python batch_scan.py --workers 8
+    python batch_scan.py --csv systems.csv --workers 8
+"""
+import argparse
+import csv
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from saver import get_user_data_path
+
+
+def load_jobs_from_config(fname, only_checked=True):
+    """[(system_name, entry_point), ...] from main_prog.cfg"""
+    with open(fname, 'rb') as f:
+        settings = pickle.load(f)
+    return [(job['system_name'], job['entry_point']) for job in settings if job['checked'] or not only_checked]
+
+
+def load_jobs_from_csv(fname):
+    """[(system_name, entry_point), ...] from ';' separated CSV with header. Same layout as import_settings uses"""
+    with open(fname, 'r', newline='') as file:
+        reader = csv.reader(file, delimiter=';')
+        next(reader)  # header
+        return [(row[0], row[1]) for row in reader if len(row) > 1 and row[0] and row[1]]
+
+
+def scan_system(system_name: str, entry_point: str, deep_scan: bool = True, quick: bool = False):
+    """
+    Scans one system. Runs in a worker process.
+    Returns (system_name, error message or None, number of modules found, seconds spent)
+    """
+    from scanner import Scanner  # Qt objects are created in the worker process
+
+    result = {'modules': 0, 'error': None}
+
+    def module_found(module: dict):
+        if module.get('serial'):
+            result['modules'] += 1
+
+    def communication_error(message: str):
+        result['error'] = message
+
+    start_time = time.time()
+    scanner = Scanner(system_name=system_name, entry_point=entry_point, deep_scan=deep_scan, quick=quick)
+    scanner.signals.module_found.connect(module_found)
+    scanner.signals.communication_error.connect(communication_error)
+    scanner.run()
+    return system_name, result['error'], result['modules'], time.time() - start_time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CIP Inventory Resource Tracker batch scanner")
+    parser.add_argument('--config', help="job list saved by main program (default: user data main_prog.cfg)")
+    parser.add_argument('--csv', help="';' separated CSV: system name; entry point")
+    parser.add_argument('--workers', type=int, default=4, help="number of scanning processes (default: 4)")
+    parser.add_argument('--all', action='store_true', help="scan unchecked systems of the job list too")
+    parser.add_argument('--shallow', action='store_true', help="do not scan deep ControlNet")
+    parser.add_argument('--quick', action='store_true', help="quick rescan of modules found by the last scan")
+    args = parser.parse_args(argv)
+
+    data_path = get_user_data_path()
+    data_path.mkdir(parents=True, exist_ok=True)
+
+    if args.csv:
+        jobs = load_jobs_from_csv(args.csv)
+    else:
+        jobs = load_jobs_from_config(args.config or data_path / "main_prog.cfg", only_checked=not args.all)
+    if not jobs:
+        print("Nothing to scan")
+        return 1
+    print(f"Scanning {len(jobs)} systems with {args.workers} workers...")
+
+    start_time = time.time()
+    modules_total = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(scan_system, system_name, entry_point, not args.shallow, args.quick)
+                   for system_name, entry_point in jobs]
+        for future in as_completed(futures):
+            try:
+                system_name, error, modules, seconds = future.result()
+            except Exception as e:  # worker process died
+                failed.append(str(e))
+                print(f"Worker failed: {e}")
+                continue
+            if error:
+                failed.append(system_name)
+                print(f"{system_name:<30} ERROR {error}")
+            else:
+                modules_total += modules
+                print(f"{system_name:<30} {modules:>6} modules {seconds:>8.1f} s")
+
+    minutes = (time.time() - start_time) / 60
+    done = len(jobs) - len(failed)
+    print('-' * 60)
+    print(f"Systems: {done} scanned, {len(failed)} failed in {minutes:.1f} min")
+    if minutes:
+        print(f"Throughput: {done / minutes:.2f} systems/min, {modules_total / minutes:.1f} modules/min")
+    return 0 if not failed else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# Which request variant each kind of device answers, kept between runs
+import os
+import pickle
+import tempfile
+import threading
+from contextlib import contextmanager
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+from saver import get_user_data_path
+
+
+def product_key(identity: dict) -> tuple:
+    """Device class as identity tells: (vendor#, product_type#, product_code, major revision)"""
+    return identity.get('vendor#'), identity.get('product_type#'), identity.get('product_code'), identity.get('major')
+
+
+@contextmanager
+def file_lock(fname):
+    """Exclusive lock of fname.lock. Holds off other threads and processes (batch_scan workers) alike"""
+    with open(f'{fname}.lock', 'a+b') as file:
+        if os.name == 'nt':
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)  # gives up after 10 s
+                    break
+                except OSError:
+                    pass
+        else:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+class CapabilityCache(object):
+    """
+    Remembers which variant of a request (like 'connected' / 'unconnected', 'msp' / 'who') a device answered,
+    so the next time the working variant goes first and the failing one is not sent at all.
+
+    Variants are kept per device class (see product_key). Before the device at a path is identified,
+    they are kept per path. Paths identified once are mapped to their device class, so at the next run
+    the variant is known before the first request.
+
+    Attributes:
+        products (dict): {product key: {request name: variant, 'bp_size': learned size of its backplane}}
+        paths (dict): {cip_path: product key}
+        path_variants (dict): {cip_path: {request name: variant}} for paths not identified yet
+    """
+
+    def __init__(self, fname=None):
+        self._fname = fname or get_user_data_path() / 'capabilities.pkl'
+        self.products = {}
+        self.paths = {}
+        self.path_variants = {}
+        self._forgotten = set()  # paths to drop from the file at save
+        self._lock = threading.Lock()
+
+    def _variants(self, cip_path=None, identity=None, create=False):
+        key = product_key(identity) if identity else self.paths.get(cip_path)
+        if key is not None:
+            return self.products.setdefault(key, {}) if create else self.products.get(key)
+        if cip_path is None:
+            return None
+        return self.path_variants.setdefault(cip_path, {}) if create else self.path_variants.get(cip_path)
+
+    def variant(self, request_name: str, cip_path: str = None, identity: dict = None):
+        """Variant known to work, None if not known"""
+        with self._lock:
+            variants = self._variants(cip_path, identity)
+            return variants.get(request_name) if variants else None
+
+    def order(self, request_name: str, variants: list, cip_path: str = None, identity: dict = None) -> list:
+        """variants [(variant, anything), ...] with the one known to work first"""
+        known = self.variant(request_name, cip_path, identity)
+        return sorted(variants, key=lambda item: item[0] != known)
+
+    def record(self, request_name: str, variant: str, cip_path: str = None, identity: dict = None):
+        with self._lock:
+            variants = self._variants(cip_path, identity, create=True)
+            if variants is not None:
+                variants[request_name] = variant
+
+    def learned_size(self, identity: dict) -> int:
+        """Slots up to the last populated one ever seen behind this kind of adapter, 0 if never scanned"""
+        return self.variant('bp_size', identity=identity) or 0
+
+    def learn_size(self, identity: dict, size: int):
+        with self._lock:
+            variants = self._variants(identity=identity, create=True)
+            variants['bp_size'] = max(size, variants.get('bp_size', 0))
+
+    def known_path(self, cip_path: str) -> bool:
+        """A device was identified at cip_path by some scan"""
+        with self._lock:
+            return cip_path in self.paths
+
+    def forget_path(self, cip_path: str):
+        """Device at cip_path is gone"""
+        with self._lock:
+            self.paths.pop(cip_path, None)
+            self._forgotten.add(cip_path)
+
+    def remember_path(self, cip_path: str, identity: dict):
+        """Device at cip_path is identified. What was learned about the path goes to its device class"""
+        key = product_key(identity)
+        with self._lock:
+            self.paths[cip_path] = key
+            self._forgotten.discard(cip_path)
+            learned = self.path_variants.pop(cip_path, None)
+            if learned:
+                self.products.setdefault(key, {}).update(learned)
+
+    def load(self):
+        """Loads cache if exists. Broken or missing cache means default order of variants"""
+        try:
+            with open(self._fname, 'rb') as file:
+                data = pickle.load(file)
+            with self._lock:
+                self.products = data['products']
+                self.paths = data['paths']
+                self.path_variants = data['path_variants']
+        except FileNotFoundError:
+            pass
+        except (pickle.PickleError, EOFError, KeyError) as e:
+            print(f"Broken capability cache {self._fname}: {e}")
+        return self
+
+    def save(self):
+        """
+        Merges into the file, so scanners in other threads and processes do not lose what they learned.
+        Merges are serialized by file_lock, every one writes its own temporary file
+        """
+        directory = os.path.dirname(self._fname)
+        os.makedirs(directory, exist_ok=True)
+        with file_lock(self._fname):
+            on_disk = CapabilityCache(self._fname).load()
+            with self._lock:
+                on_disk.products.update(self.products)
+                on_disk.paths.update(self.paths)
+                for path in self._forgotten:
+                    on_disk.paths.pop(path, None)
+                on_disk.path_variants.update(self.path_variants)
+                for path in on_disk.paths:
+                    on_disk.path_variants.pop(path, None)
+                data = {'products': on_disk.products, 'paths': on_disk.paths, 'path_variants': on_disk.path_variants}
+            fd, tmp_fname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    pickle.dump(data, file)
+                os.replace(tmp_fname, self._fname)
+            except BaseException:
+                os.remove(tmp_fname)
+                raise
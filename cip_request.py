@@ -1,4 +1,6 @@
-from pycomm3 import Services, ClassCode, STRING
+from pycomm3 import Services, ClassCode, STRING, UINT, USINT, PADDED_EPATH, ConnectionManagerServices
+from pycomm3.cip_driver import parse_cip_route
+from pycomm3.packets.util import request_path
 from shassy import shassy_ident, My_CN_Node_number
 
 who = {
@@ -77,3 +79,117 @@ cn_address = {
     "name": 'CN_NODE_ADDR'
 }
 
+cn_address_unconnected = {
+    **cn_address,
+    "connected": False,
+    "unconnected_send": True,
+}
+
+# Reply of an adapter to a route beyond the last module of its bus (Point I/O)
+link_address_unavailable_error = "Link address not available"
+
+# Reply to Multiple Service Packet some embedded service of which failed (0x1E). Embedded replies keep own status
+msp_partial_error = "Request service error"
+
+# Reply of a bridge which gave up waiting for the target (0x01 with extended status 0x0204 / 0x0203)
+timeout_errors = ("Unconnected message timeout", "Connection timeout")
+
+# Replies of the route, not of a target: there is nothing at the route (0x01 with 0x0204, 0x0311, 0x0312...)
+route_errors = ("Connection failure", "Path segment error", "Path destination unknown")
+
+
+def error_in(error, errors) -> bool:
+    """Error text of a reply (as pycomm3 words the status) tells one of errors"""
+    return bool(error) and any(text in error for text in errors)
+
+
+def _embedded(request: dict) -> bytes:
+    return b"".join((
+        request["service"],
+        request_path(request["class_code"], request["instance"], request.get("attribute", b"")),
+        request.get("request_data", b""),
+    ))
+
+
+def multiple_service(requests: list, name: str = "multiple_service") -> dict:
+    """
+    Bundles unconnected requests to one module into one Multiple Service Packet (service 0x0A to Message Router)
+    :param requests: requests above
+    :return: kwargs for CIPDriver.generic_message, reply goes to parse_multiple_service
+    """
+    messages = [_embedded(request) for request in requests]
+    offset = 2 + 2 * len(messages)  # from the start of the count
+    offsets = []
+    for message in messages:
+        offsets.append(UINT.encode(offset))
+        offset += len(message)
+    return {
+        "service": Services.multiple_service_request,
+        "class_code": ClassCode.message_router,
+        "instance": 0x1,
+        "request_data": b"".join((UINT.encode(len(messages)), *offsets, *messages)),
+        "connected": False,
+        "unconnected_send": True,
+        "route_path": True,
+        "name": name,
+    }
+
+
+def parse_multiple_service(data: bytes) -> list:
+    """
+    Replies of Multiple Service Packet, in order of requests
+    :return: [(general status, reply data), ...]
+    """
+    count = UINT.decode(data[0:2])
+    offsets = [UINT.decode(data[2 + 2 * i:4 + 2 * i]) for i in range(count)]
+    replies = []
+    for i, start in enumerate(offsets):
+        end = offsets[i + 1] if i + 1 < count else len(data)
+        reply = data[start:end]
+        status = USINT.decode(reply[2:3])
+        extended_words = USINT.decode(reply[3:4])
+        replies.append((status, reply[4 + 2 * extended_words:]))
+    return replies
+
+
+module_info_requests = (who, plc_name, cn_address_unconnected)
+module_info = multiple_service(list(module_info_requests), name="module_info")
+
+
+def unconnected_send(request: dict, route: str, timeout_ms: int) -> dict:
+    """
+    Wraps unconnected request into Unconnected Send with own timeout.
+    pycomm3 always asks the bridge to wait 5 ticks * 1024 ms for the target, here timeout_ms is used.
+    :param request: one of unconnected requests above
+    :param route: route path from the entry point, like 'bp/2/cnet/3'
+    :param timeout_ms: how long the first bridge waits for the target
+    :return: kwargs for CIPDriver.generic_message
+    """
+    tick = 0  # tick time = 2**tick ms, up to 255 ticks
+    while timeout_ms > 255 * 2 ** tick and tick < 15:
+        tick += 1
+    ticks = min(255, max(1, -(-timeout_ms // 2 ** tick)))
+
+    message = b"".join((
+        request["service"],
+        request_path(request["class_code"], request["instance"], request.get("attribute", b"")),
+        request.get("request_data", b""),
+    ))
+    request_data = b"".join((
+        bytes([tick, ticks]),
+        UINT.encode(len(message)),
+        message,
+        b"\x00" if len(message) % 2 else b"",
+        PADDED_EPATH.encode(parse_cip_route(route), length=True, pad_length=True),
+    ))
+    return {
+        "service": ConnectionManagerServices.unconnected_send,
+        "class_code": ClassCode.connection_manager,
+        "instance": 0x1,
+        "request_data": request_data,
+        "data_type": request.get("data_type"),
+        "connected": False,
+        "unconnected_send": False,
+        "route_path": False,
+        "name": request.get("name", "generic"),
+    }
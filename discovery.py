@@ -0,0 +1,114 @@
+# Discovery of EtherNet/IP entry points by ListIdentity broadcast and unicast sweep
+import ipaddress
+import re
+import selectors
+import socket
+import struct
+import time
+
+from shassy import MyModuleIdentityObject
+
+ENIP_PORT = 44818
+LIST_IDENTITY = 0x0063
+LIST_IDENTITY_REQUEST = struct.pack('<HHII8sI', LIST_IDENTITY, 0, 0, 0, b'\x00' * 8, 0)
+IDENTITY_ITEM = 0x000C
+IDENTITY_OFFSET = 48  # encapsulation header 24, item count 2, type 2, length 2, version 2, socket address 16
+
+
+def parse_list_identity(reply: bytes, source: str = None):
+    """
+    Identity of a ListIdentity reply, same fields as MyModuleIdentityObject, plus 'ip'.
+    'ip' is the address the reply came from, or the one the module reports if source is not given.
+    None if the reply is not a valid ListIdentity reply.
+    """
+    if len(reply) < IDENTITY_OFFSET:
+        return None
+    command, _, _, status = struct.unpack('<HHII', reply[:12])
+    item_count, item_type = struct.unpack('<HH', reply[24:28])
+    if command != LIST_IDENTITY or status or not item_count or item_type != IDENTITY_ITEM:
+        return None
+    try:
+        identity = MyModuleIdentityObject.decode(reply[IDENTITY_OFFSET:])
+    except Exception:  # truncated or not an identity
+        return None
+    identity['ip'] = source or socket.inet_ntoa(reply[36:40])  # sin_addr, big endian
+    return identity
+
+
+def parse_networks(text: str) -> list:
+    """'10.1.0.0/22, 10.2.3.4' -> [IPv4Network, ...]. Raises ValueError on a bad network"""
+    return [ipaddress.ip_network(item, strict=False) for item in re.split(r'[\s,;]+', text.strip()) if item]
+
+
+def system_name_for(identity: dict) -> str:
+    """Suggested system name, no spaces as SystemNameWidget requires"""
+    name = re.sub(r'[^\w.-]+', '_', identity.get('product_name', '').strip()).strip('_') or 'module'
+    return f"{name}_{identity['ip']}"
+
+
+def discover(networks, broadcast: bool = True, unicast: bool = True, timeout: float = 2.0,
+             sends_per_second: int = 2000, found=None, progress=None, stopped=None) -> dict:
+    """
+    Sends ListIdentity to every network and collects all replies in one pass.
+    :param networks: list of ipaddress networks
+    :param broadcast: send to broadcast address of every network
+    :param unicast: send to every host of every network, broadcasts do not pass routers
+    :param timeout: seconds to wait for replies after the last request
+    :param sends_per_second: pacing of unicast sweep, not to flood small switches
+    :param found: callback(identity) for every new responder
+    :param progress: callback(sent, total)
+    :param stopped: callable, True when discovery is to end now. Checked at least every 0.1 s
+    :return: {ip: identity}
+    """
+    targets = []
+    for network in networks:
+        if broadcast and network.num_addresses > 1:
+            targets.append(str(network.broadcast_address))
+        if unicast:
+            targets.extend(str(host) for host in (network.hosts() if network.num_addresses > 1 else [network.network_address]))
+    responders = {}
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+
+    def receive(wait: float):
+        for _ in selector.select(wait):
+            while True:
+                try:
+                    reply, (source, _) = sock.recvfrom(4096)
+                except (BlockingIOError, InterruptedError):
+                    return
+                except OSError:  # ICMP port unreachable of some host
+                    continue
+                identity = parse_list_identity(reply, source)
+                if identity is None or identity['ip'] in responders:
+                    continue
+                responders[identity['ip']] = identity
+                if found:
+                    found(identity)
+
+    try:
+        interval = 1 / sends_per_second if sends_per_second else 0
+        started = time.perf_counter()
+        for sent, target in enumerate(targets, start=1):
+            if stopped and stopped():
+                return responders
+            try:
+                sock.sendto(LIST_IDENTITY_REQUEST, (target, ENIP_PORT))
+            except OSError as e:  # no route, broadcast not permitted
+                print(f"ListIdentity to {target} failed: {e}")
+            receive(max(0.0, started + sent * interval - time.perf_counter()))
+            if progress and (sent % 256 == 0 or sent == len(targets)):
+                progress(sent, len(targets))
+        deadline = time.perf_counter() + timeout
+        while (left := deadline - time.perf_counter()) > 0:
+            if stopped and stopped():
+                break
+            receive(min(left, 0.1) if stopped else left)
+    finally:
+        selector.close()
+        sock.close()
+    return responders
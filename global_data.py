@@ -1,37 +1,64 @@
 # module for storing global program data
+import os
 import pickle
+import sqlite3
 from copy import deepcopy
 
+import numpy as np
+import pandas as pd
+
 class comment_saver_cls(object):
     """
     A class to manage and persist comments associated with serial numbers,
-    storing data in a plain text file.
+    storing data in SQLite, one row per serial number. An edit is a single
+    upsert, so saving does not rewrite other comments and a crash can not
+    truncate them.
 
     Attributes:
-        _fname (str): The default filename for saving/loading comments.
+        _fname (str): The database file for saving/loading comments.
+        _legacy_fname (str): Plain text comments file of old versions.
+                             Moved into the database at the first load.
         sn (dict): A dictionary storing serial numbers as keys and lists of
-                   comment lines as values.
+                   comment lines as values. In-memory copy of the database.
+        joined (dict): Serial numbers and their comments joined in one string,
+                       for Series.map over whole serial column at once.
 
     Methods:
-        __init__(self, fname='comments.txt'): Initializes the class with a
-                                                  filename.
+        __init__(self, fname='comments.db', legacy_fname=None): Initializes
+                                                  the class with a filename.
         get_comment(self, sn: str): Retrieves the comment for a given serial
                                       number.
         set_comment(self, sn: str, comment: str): Sets the comment for a given
                                                   serial number.
-        save(self, filename=None): Saves the comments to a text file.
-        load(self, filename=None): Loads comments from a text file.
+        save(self, filename=None): Commits the comments set since last save,
+                                   or exports all of them to a text file.
+        load(self, filename=None): Loads comments from the database.
     """
-    def __init__(self, fname='comments.txt'):
+    def __init__(self, fname='comments.db', legacy_fname=None):
         """
         Initializes the comment_saver_cls object.
 
         Args:
-            fname (str, optional): The filename for saving/loading comments.
-                                    Defaults to 'comments.txt'.
+            fname (str, optional): The database file for saving/loading
+                                    comments. Defaults to 'comments.db'.
+            legacy_fname (str, optional): Plain text comments file to import
+                                    while the database is empty. Defaults to
+                                    'comments.txt' next to the database.
         """
         self._fname = fname
+        self._legacy_fname = legacy_fname or os.path.join(os.path.dirname(fname), 'comments.txt')
         self.sn = {}
+        self.joined = {}
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # loaded by the data loading thread, edited in the GUI thread. Never at once
+            self._connection = sqlite3.connect(self._fname, check_same_thread=False)
+            with self._connection:
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS comment (serial TEXT PRIMARY KEY, comment TEXT NOT NULL)')
+        return self._connection
 
     def get_comment(self, sn: str) -> str:
         """
@@ -46,71 +73,111 @@ class comment_saver_cls(object):
         """
         if sn is None:
             return None
-        comment_lines = self.sn.get(sn, [])
-        if len(comment_lines) == 0:
-            return None
-        return "\n".join(comment_lines)
+        return self.joined.get(sn)
 
     def set_comment(self, sn: str, comment: str):
         """
-        Sets or updates the comment for a given serial number.
+        Sets or updates the comment for a given serial number. Written to the
+        database at once, kept on disk by the next save().
 
         Args:
             sn (str): The serial number to set the comment for.
             comment (str): The comment to be associated with the serial number.
         """
         self.sn[sn] = [line.lstrip() for line in comment.splitlines()]
+        if self.sn[sn]:
+            self.joined[sn] = "\n".join(self.sn[sn])
+            self._connect().execute('INSERT OR REPLACE INTO comment (serial, comment) VALUES (?, ?)',
+                                    (sn, self.joined[sn]))
+        else:
+            self.joined.pop(sn, None)
+            self._connect().execute('DELETE FROM comment WHERE serial = ?', (sn,))
 
     def save(self, filename: str = None):
         """
-        Saves the comments dictionary to a text file.
+        Commits comments set since the last save. With filename, exports all
+        comments to a text file in the format of old versions instead.
 
         Args:
-            filename (str, optional): The filename to save to. If None, uses
-                                        the default _fname. Defaults to None.
+            filename (str, optional): Text file to export to. Defaults to None.
         """
-        fname = filename or self._fname
-        with open(fname, 'w') as file:
+        if filename is None:
+            self._connect().commit()
+            return
+        tmp_fname = f'{filename}.tmp'
+        with open(tmp_fname, 'w') as file:
             for sn, comment_lines in self.sn.items():
+                if not comment_lines:
+                    continue
                 file.write(f"{sn}\n")
                 for line in comment_lines:
                     file.write(f"  {line}\n")
-        # print(f"Comments saved in {fname}")
+        os.replace(tmp_fname, filename)
 
     def load(self, filename: str = None):
         """
-        Loads comments from a text file. Handles potential errors gracefully.
+        Loads comments from the database. Comments of the plain text file of
+        old versions are moved in while the database is empty.
 
         Args:
-            filename (str, optional): The filename to load from. If None, uses
-                                         the default _fname. Defaults to None.
+            filename (str, optional): The database file to load from. If None,
+                                         uses the default _fname. Defaults to None.
         """
-        fname = filename or self._fname
-        self.sn = {}
-        try:
-            with open(fname, 'r') as file:
-                current_sn = None
-                for line in file:
-                    line = line.rstrip('\n')  # Remove trailing newline
-                    if line.startswith("#"):  # ignore line
-                        continue
-                    if line.startswith("  "):  # Comment line
-                        try:
-                            self.sn[current_sn].append(line.lstrip())  # Remove leading spaces
-                        except AttributeError:
-                            # Skip lines at the top of file while not found SN
-                            continue
-                        except KeyError:
-                            self.sn[current_sn] = []
-                            self.sn[current_sn].append(line.lstrip())  # second try
-                    else:  # Serial number line
-                        current_sn = line.split(sep=" ")[0]
-                        # self.sn[current_sn] = []
-        except FileNotFoundError:
-            print(f"No {fname} yet! Let's create one")
-            self.save(filename=fname)
+        if filename is not None and filename != self._fname:
+            self.close()
+            self._fname = filename
+        connection = self._connect()
+        if connection.execute('SELECT 1 FROM comment LIMIT 1').fetchone() is None \
+                and os.path.exists(self._legacy_fname):
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO comment (serial, comment) VALUES (?, ?)',
+                                       ((sn, "\n".join(lines)) for sn, lines in
+                                        read_comments_text(self._legacy_fname).items() if lines))
+            print(f"Comments of {self._legacy_fname} moved to {self._fname}")
+        self.joined = dict(connection.execute('SELECT serial, comment FROM comment'))
+        self.sn = {sn: comment.split("\n") for sn, comment in self.joined.items()}
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.commit()
+            self._connection.close()
+            self._connection = None
+
+
+def read_comments_text(fname) -> dict:
+    """
+    Comments of plain text file of old versions: serial number line, then its comment lines indented
+    by two spaces. Lines starting with # are ignored.
+
+    Returns:
+        dict: serial number: list of comment lines
+    """
+    sn = {}
+    with open(fname, 'r') as file:
+        current_sn = None
+        for line in file:
+            line = line.rstrip('\n')  # Remove trailing newline
+            if line.startswith("#"):  # ignore line
+                continue
+            if line.startswith("  "):  # Comment line
+                if current_sn is None:
+                    continue  # Skip lines at the top of file while not found SN
+                sn.setdefault(current_sn, []).append(line.lstrip())  # Remove leading spaces
+            else:  # Serial number line
+                current_sn = line.split(sep=" ")[0]
+    return sn
+
 
 class global_data_cls(object):
+    """
+    Modules found by the scanner and their storage.
+
+    Data file is a zip of numpy arrays (np.savez), column by column: one array per module attribute,
+    a null mask per text column and a type per value of columns holding not only strings (see value_kind).
+    Loads without pickle, so it is safe to open from any share.
+    Old pickled data files are read only with allow_legacy=True, by migration of the user's own files.
+    """
+
     def __init__(self, fname='global.data'):
         self.__fname = fname
         self.entry_point = {}
@@ -118,6 +185,7 @@ class global_data_cls(object):
         self.bp = {}
         self.cn_flex = {}
         self.cn_nodes = []
+        self.legacy = False  # last restored file was pickled
 
     def flush(self):
         """remove all datas"""
@@ -128,43 +196,164 @@ class global_data_cls(object):
         self.cn_nodes = []
 
     def store_data(self, filename=None):
-        """Stores data using pickle.
+        """Stores data column by column. File is replaced at once, readers never see it half written.
 
       Args:
         filename: The name of the file to store the data in.
       """
         fname = filename or self.__fname
-        data = {
-            'entry_point': self.entry_point,
-            'module': self.module,
-            'bp': self.bp,
-            'cn_flex': self.cn_flex,
-            'cn_nodes': self.cn_nodes
-        }
-        with open(fname, 'wb') as file:
-            pickle.dump(data, file)
+        tmp_fname = f'{fname}.tmp'
+        with open(tmp_fname, 'wb') as file:
+            np.savez_compressed(file, **modules_to_columns(self.module, self.cn_nodes))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_fname, fname)
         print(f"Data [{self.entry_point}] saved in {fname}")
 
-    def restore_data(self, filename=None):
-        """Restores data from a pickle file.
+    def restore_columns(self, filename=None, allow_legacy=False) -> dict:
+        """Restores data as {column name: numpy array}. No per-module python objects created.
+
+        Args:
+        filename: The name of the file containing the data.
+        allow_legacy: Allow to unpickle data files of old versions. Never do it for untrusted files.
+        """
+        fname = filename or self.__fname
+        with open(fname, 'rb') as file:
+            self.legacy = file.read(len(ZIP_MAGIC)) != ZIP_MAGIC
+            if not self.legacy:
+                file.seek(0)
+                with np.load(file, allow_pickle=False) as npz:
+                    return {name: npz[name] for name in npz.files}
+        if not allow_legacy:
+            raise ValueError(f"{fname} is pickled data file of old version")
+        data = self._restore_pickle(fname)
+        return modules_to_columns(data['module'], data['cn_nodes'])
+
+    def restore_frame(self, filename=None, allow_legacy=False) -> pd.DataFrame:
+        """Restores modules as DataFrame indexed by system path, one column per module attribute"""
+        return columns_to_frame(self.restore_columns(filename, allow_legacy))
+
+    def restore_data(self, filename=None, allow_legacy=False):
+        """Restores data from a file. Values get back their types (int, bytes...) as they were scanned.
 
         Args:
-        filename: The name of the file containing the pickled data.
+        filename: The name of the file containing the data.
+        allow_legacy: Allow to unpickle data files of old versions. Never do it for untrusted files.
 
         Returns:
         The restored data.
         """
-        fname = filename or self.__fname
+        columns = self.restore_columns(filename, allow_legacy)
+        frame = columns_to_frame(columns)
+        kinds = {name: columns[KIND_PREFIX + name] for name in columns_names(columns) if KIND_PREFIX + name in columns}
+        self.module = {}
+        for row_index, (key, row) in enumerate(frame.to_dict(orient='index').items()):
+            module = {name: (None if pd.isna(value) else value) for name, value in row.items()}
+            for name, column_kinds in kinds.items():
+                if module[name] is not None:
+                    module[name] = typed_value(module[name], column_kinds[row_index])
+            self.module[key] = module
+        offsets = np.cumsum(columns['cn_nodes_len'])[:-1]
+        self.cn_nodes = [nodes.tolist() for nodes in np.split(columns['cn_nodes'], offsets)] \
+            if len(columns['cn_nodes_len']) else []
+        return {
+            'entry_point': self.entry_point,
+            'module': self.module,
+            'bp': self.bp,
+            'cn_flex': self.cn_flex,
+            'cn_nodes': self.cn_nodes
+        }
+
+    def _restore_pickle(self, fname):
         with open(fname, 'rb') as file:
             data = pickle.load(file)
             self.entry_point = data['entry_point']
-            self.module = data['module']
             self.bp = data['bp']
             self.cn_flex = data['cn_flex']
-            self.cn_nodes = data['cn_nodes']
             return data
 
 
+ZIP_MAGIC = b'PK\x03\x04'
+COLUMN_PREFIX = 'col:'
+NULL_PREFIX = 'null:'
+KIND_PREFIX = 'kind:'
+KIND_STR, KIND_INT, KIND_BYTES, KIND_FLOAT = range(4)
+numeric_columns = ("vendor#", "product_type#", "product_code", "major", "minor", "slot")
+
+
+def column_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def value_kind(value) -> int:
+    """Type of the value to restore it from its column (see typed_value)"""
+    if isinstance(value, bool):
+        return KIND_STR
+    if isinstance(value, int):
+        return KIND_INT
+    if isinstance(value, bytes):
+        return KIND_BYTES
+    if isinstance(value, float):
+        return KIND_FLOAT
+    return KIND_STR
+
+
+def typed_value(value, kind):
+    """Value as stored in its column --> value of the type value_kind gave"""
+    if kind == KIND_INT:
+        return int(float(value)) if isinstance(value, float) else int(value)
+    if kind == KIND_BYTES:
+        return bytes.fromhex(value)
+    if kind == KIND_FLOAT:
+        return float(value)
+    return value
+
+
+def modules_to_columns(modules: dict, cn_nodes: list) -> dict:
+    """{system path: module dict} --> {array name: numpy array} as stored in data file"""
+    names = list(blank_module)
+    for module in modules.values():
+        names.extend(name for name in module if name not in names)
+    rows = list(modules.values())
+
+    columns = {'key': np.array(list(modules), dtype=str)}
+    for name in names:
+        values = [module.get(name) for module in rows]
+        if name in numeric_columns:
+            columns[COLUMN_PREFIX + name] = np.array([np.nan if v is None else v for v in values], dtype=float)
+            kinds = np.array([KIND_INT if value_kind(v) == KIND_INT else KIND_STR for v in values], dtype=np.uint8)
+        else:
+            columns[COLUMN_PREFIX + name] = np.array([column_value(v) for v in values], dtype=str)
+            columns[NULL_PREFIX + name] = np.array([v is None for v in values], dtype=bool)
+            kinds = np.array([value_kind(v) for v in values], dtype=np.uint8)
+        if kinds.any():  # only strings (floats in numeric columns) need no types
+            columns[KIND_PREFIX + name] = kinds
+    columns['cn_nodes'] = np.array([node for nodes in cn_nodes for node in nodes], dtype=int)
+    columns['cn_nodes_len'] = np.array([len(nodes) for nodes in cn_nodes], dtype=int)
+    return columns
+
+
+def columns_names(columns: dict) -> list:
+    return [name[len(COLUMN_PREFIX):] for name in columns if name.startswith(COLUMN_PREFIX)]
+
+
+def columns_to_frame(columns: dict) -> pd.DataFrame:
+    """Arrays as stored in data file --> DataFrame indexed by system path. Nulls are None (NaN for numbers)"""
+    frame = {}
+    for name in columns_names(columns):
+        values = columns[COLUMN_PREFIX + name]
+        null = columns.get(NULL_PREFIX + name)
+        if null is not None and null.any():
+            values = values.astype(object)
+            values[null] = None
+        frame[name] = values
+    return pd.DataFrame(frame, index=columns['key'])
+
+
 global_data = global_data_cls()
 
 current_comment_saver = None
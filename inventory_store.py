@@ -0,0 +1,131 @@
+# Consolidated inventory of all scanned systems in one SQLite database
+import os
+import sqlite3
+
+import pandas as pd
+
+from global_data import blank_module, numeric_columns, column_value, global_data_cls
+from saver import get_user_data_path
+
+indexed_columns = ("serial", "system", "path", "product_code")
+
+
+def _quoted(name: str) -> str:
+    return f'"{name}"'
+
+
+class InventoryStore(object):
+    """
+    All modules of all systems in one table, keyed by system path.
+    Scanner replaces rows of its system after every successful scan.
+    Table imported_file tells the .data files (name, mtime) whose content is in the store already.
+    Indexed by serial, system, path and product_code, so ad-hoc queries do not need a full load.
+    """
+
+    def __init__(self, fname=None):
+        self._fname = fname or get_user_data_path() / 'inventory.db'
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._fname, timeout=30)  # scanners of other systems may write now
+        connection.execute("PRAGMA journal_mode=WAL")
+        columns = ', '.join(f'{_quoted(name)} {"REAL" if name in numeric_columns else "TEXT"}'
+                            for name in blank_module)
+        with connection:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS module ("key" TEXT PRIMARY KEY, {columns})')
+            for name in indexed_columns:
+                connection.execute(f'CREATE INDEX IF NOT EXISTS "module_{name}" ON module ({_quoted(name)})')
+            connection.execute('CREATE TABLE IF NOT EXISTS imported_file ("name" TEXT PRIMARY KEY, "mtime" REAL)')
+        return connection
+
+    def upsert_system(self, system_name: str, modules: dict, data_file=None):
+        """
+        Replaces all modules of the system. modules: {system path: module dict} as Scanner collects
+        :param data_file: .data file the modules are stored in too. It is not imported again (see import_data_files)
+        """
+        names = list(blank_module)
+        rows = [(key, *(self._value(name, module.get(name)) for name in names)) for key, module in modules.items()]
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute('DELETE FROM module WHERE "system" = ?', (system_name,))
+                connection.executemany(
+                    f'INSERT OR REPLACE INTO module ("key", {", ".join(map(_quoted, names))}) '
+                    f'VALUES (?, {", ".join("?" for _ in names)})',
+                    rows)
+                if data_file is not None:
+                    self._record_file(connection, data_file)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _record_file(connection, fname):
+        connection.execute('INSERT OR REPLACE INTO imported_file ("name", "mtime") VALUES (?, ?)',
+                           (os.path.basename(fname), os.path.getmtime(fname)))
+
+    @staticmethod
+    def _value(name, value):
+        if value is None or name in numeric_columns:
+            return value
+        return column_value(value)
+
+    def load_frame(self, where: str = '', params=()) -> pd.DataFrame:
+        """
+        Modules as DataFrame indexed by system path
+        :param where: optional SQL condition, like '"serial" = ?'
+        """
+        connection = self.connect()
+        try:
+            query = 'SELECT * FROM module' + (f' WHERE {where}' if where else '')
+            frame = pd.read_sql_query(query, connection, index_col='key', params=params)
+        finally:
+            connection.close()
+        for name in numeric_columns:
+            frame[name] = frame[name].astype(float)  # all NULL column comes as objects
+        return frame
+
+    def systems(self) -> list:
+        connection = self.connect()
+        try:
+            return [row[0] for row in connection.execute('SELECT DISTINCT "system" FROM module ORDER BY "system"')]
+        finally:
+            connection.close()
+
+    def is_empty(self) -> bool:
+        connection = self.connect()
+        try:
+            return connection.execute('SELECT 1 FROM module LIMIT 1').fetchone() is None
+        finally:
+            connection.close()
+
+    def import_data_files(self, path):
+        """
+        Adds systems of *.data files in path which are not in the store yet. A file is read again only
+        when it changed since (imported_file). Files which fail to read are reported and skipped until they change.
+        Pickled files of old versions are read too: path is the user's own data directory.
+        """
+        connection = self.connect()
+        try:
+            imported = dict(connection.execute('SELECT "name", "mtime" FROM imported_file'))
+        finally:
+            connection.close()
+        for file in sorted(os.listdir(path)):
+            fname = os.path.join(path, file)
+            if not file.endswith(".data") or not os.path.isfile(fname) \
+                    or imported.get(file) == os.path.getmtime(fname):
+                continue
+            try:
+                modules = global_data_cls(fname=fname).restore_data(allow_legacy=True)['module']
+                known = set(self.systems())
+                for system_name in {module.get('system') for module in modules.values()} - known:
+                    self.upsert_system(system_name, {key: module for key, module in modules.items()
+                                                     if module.get('system') == system_name})
+            except Exception as e:
+                print(f"{file} not imported into inventory store: {e}")
+            else:
+                print(f"{file} imported into inventory store")
+            connection = self.connect()
+            try:
+                with connection:
+                    self._record_file(connection, fname)
+            finally:
+                connection.close()
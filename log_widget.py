@@ -1,3 +1,4 @@
+import os
 import sys
 import time, datetime
 
@@ -5,15 +6,18 @@ from PyQt6.QtWidgets import (
     QWidget,
     QLabel,
     QPushButton,
-    QHBoxLayout, QDialog, QTableWidget, QVBoxLayout, QTableWidgetItem, QHeaderView, QFileDialog
+    QHBoxLayout, QDialog, QTableWidget, QVBoxLayout, QTableWidgetItem, QHeaderView, QFileDialog, QPlainTextEdit
 )
+from PyQt6.QtGui import QFontDatabase
 
 
 class LogViewer(QDialog):
-    def __init__(self, parent=None, title="Log Viewer"):
+    def __init__(self, parent=None, title="Log Viewer", profile_fname=None):
+        """:param profile_fname: scan profile report (see scan_profile), shown by its button if the file exists"""
         super().__init__(parent)
         self.setWindowTitle(title)
         self.resize(600, 400)
+        self.profile_fname = profile_fname
 
         # Create a table widget to display logs
         self.table_widget = QTableWidget()
@@ -35,6 +39,11 @@ class LogViewer(QDialog):
         self.export_button.clicked.connect(self.export_logs)
         layout.addWidget(self.export_button)
 
+        self.profile_button = QPushButton("Scan Profile")
+        self.profile_button.clicked.connect(self.show_profile)
+        self.profile_button.setEnabled(bool(profile_fname) and os.path.exists(profile_fname))
+        layout.addWidget(self.profile_button)
+
         self.setLayout(layout)
 
     def update_table(self, time_list, log_list):
@@ -43,6 +52,21 @@ class LogViewer(QDialog):
             self.table_widget.setItem(i, 0, QTableWidgetItem(f"{t:.2f}"))
             self.table_widget.setItem(i, 1, QTableWidgetItem(msg))
 
+    def show_profile(self):
+        with open(self.profile_fname, encoding='utf-8') as f:
+            report = f.read()
+        dialog = QDialog(self)
+        dialog.setWindowTitle(f"{self.windowTitle()} - scan profile")
+        dialog.resize(800, 500)
+        text = QPlainTextEdit(report)
+        text.setReadOnly(True)
+        text.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        text.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        layout = QVBoxLayout()
+        layout.addWidget(text)
+        dialog.setLayout(layout)
+        dialog.exec()
+
     def export_logs(self):
         # options = QFileDialog.options()
         # options |= QFileDialog.DontUseNativeDialog
@@ -56,16 +80,18 @@ class LogViewer(QDialog):
 
 
 class LogWidget(QWidget):
-    def __init__(self, log=None, init_label: str = 'Log', viewer_title = "Log Viewer"):
+    def __init__(self, log=None, init_label: str = 'Log', viewer_title = "Log Viewer", profile_fname=None):
         """
         Log under the button
         :param log:
             (time, message),
             (time, message)...
         :param init_label:
+        :param profile_fname: scan profile report the viewer shows
         """
         super().__init__()
         self.viewer_title = viewer_title
+        self.profile_fname = profile_fname
         self._start_time = time.time()
         self._log = []
         self._time = []
@@ -108,7 +134,7 @@ class LogWidget(QWidget):
         self.button.setText(message[:20])  # Update button label
 
     def show_log_viewer(self):
-        viewer = LogViewer(self, title=self.viewer_title)
+        viewer = LogViewer(self, title=self.viewer_title, profile_fname=self.profile_fname)
         viewer.update_table(self._time, self._log)
         viewer.exec()
 
@@ -21,7 +21,7 @@ from PyQt6.QtWidgets import (
     QDialog,
 )
 from PyQt6.QtGui import QIcon
-from PyQt6.QtCore import QSize, Qt, QThreadPool
+from PyQt6.QtCore import QSize, Qt, QThreadPool, QThread, pyqtSignal
 
 # from icecream import ic
 
@@ -32,70 +32,82 @@ import datetime
 import pickle
 from pathlib import Path
 
-from add_system import AddSystemDialog, EditSystemDialog
+from add_system import AddSystemDialog, EditSystemDialog, DiscoveryDialog
 from ping_widget import PingWidget
 from log_widget import LogWidget
+from scan_profile import profile_fname
 
 from version import rev
 from saver import get_user_data_path
 # from scanner import PreScaner as Scaner
-from scanner import Scanner
+from scanner import Scanner, AsyncScanner
+from scan_scheduler import ScanScheduler
 import global_data
 from global_data import global_data_cls
+from inventory_store import InventoryStore
 
 import preview_data
 
 from user_data import basedir, asset_dir
 from cog_widget import CogWidget
 
+# Scan all checked systems by one asyncio engine instead of one Scanner thread per system
+ASYNC_SCAN_ENGINE = False
+# Scans running at once through one entry point or ControlNet bridge, and request rate through it
+GATEWAY_SCAN_LIMIT = 1
+GATEWAY_REQUESTS_PER_SECOND = 50
 
-def load_data(path):
-    """Loads data from all files with "*.data" extension in the specified path.
 
-  Args:
-    path: The path to the directory containing the data files.
-
-  Returns:
-    A pandas DataFrame containing the combined data from all files.
-  """
-
-    # Get a list of all files with "*.data" extension in the path
-    data_files = [f for f in os.listdir(path) if f.endswith(".data")]
-
-    # Create an empty list to store the DataFrames
-    data_frames = []
-
-    # Iterate through each data file and load the data
-    for file in data_files:
-        # Create the full file path
-        file_path = os.path.join(path, file)
-
-        # Load data from the file
-        global_data_obj = global_data_cls(fname=file_path)
-        global_data_obj.restore_data()
-        df = pd.DataFrame.from_dict(global_data_obj.module, orient='index')
-
-        # Append the DataFrame to the list
-        data_frames.append(df)
-
-    # Concatenate the list of DataFrames into a single DataFrame
-    data = pd.concat(data_frames, ignore_index=False)
-
-    # adding comments
-    fname = get_user_data_path() / 'comments.txt'
-    comments = global_data.comment_saver_cls(fname=fname)
+def load_comments():
+    """Loads comments and makes them current for comment edits in the Data Viewer"""
+    fname = get_user_data_path() / 'comments.db'
+    comments = global_data.comment_saver_cls(fname=str(fname))
     comments.load()
+    if global_data.current_comment_saver is not None:
+        global_data.current_comment_saver.close()
     global_data.current_comment_saver = comments
 
-    data['comment'] = list('' for _ in range(len(data.index)))
     # debug injection  001aa5ef
     # global_data.current_comment_saver.set_comment('001aa5ef', 'This is a comment for BP 001aa5ef')
+    return comments
 
-    data['comment'] = data['serial'].map(comments.get_comment).fillna(data['comment'])
 
+def add_comments(data, comments):
+    data['comment'] = data['serial'].map(comments.joined).fillna('')  # one hash join, no call per row
     return data
 
 
+class DataLoader(QThread):
+    """
+    Loads data of all systems from the inventory store in the specified path out of GUI thread,
+    handing it over system by system as it is read. Systems not in the store yet are imported
+    from files with "*.data" extension in the path first.
+    """
+    system_loaded = pyqtSignal(object)  # DataFrame of one system, with comments
+    progress = pyqtSignal(int, int, str)  # systems loaded, systems total, name of the last one
+
+    def __init__(self, path, comments):
+        super().__init__()
+        self.path = path
+        self.comments = comments
+        self.store = InventoryStore(Path(path) / 'inventory.db')
+
+    def empty_frame(self):
+        """No rows, columns as loaded data has. The Data Viewer opens with it before anything is read"""
+        return add_comments(self.store.load_frame('0'), self.comments)
+
+    def run(self):
+        self.progress.emit(0, 0, '')
+        self.store.import_data_files(self.path)
+        systems = self.store.systems()
+        for done, system_name in enumerate(systems, 1):
+            if self.isInterruptionRequested():
+                return
+            frame = self.store.load_frame('"system" IS ?', (system_name,))
+            self.system_loaded.emit(add_comments(frame, self.comments))
+            self.progress.emit(done, len(systems), system_name or '')
+
+
 class MainWindow(QWidget):
     def __init__(self):
 
@@ -122,6 +134,8 @@ class MainWindow(QWidget):
         print("Multithreading with maximum %d threads" % self.threadpool.maxThreadCount())
 
         self.view_data_window = None
+        self.data_loader = None
+        self.scheduler = None
 
         if True:
             # Create layout
@@ -144,12 +158,16 @@ class MainWindow(QWidget):
             row_index = 0
             self.top_checkbox = QCheckBox()
             self.ping_checkbox = QCheckBox('Ping IP addresses')
+            self.quick_checkbox = QCheckBox('Quick rescan')
+            self.quick_checkbox.setToolTip("Probe only modules and ControlNet nodes found by the last scan.\n"
+                                           "Backplane or ControlNet is scanned fully only if something changed")
             # self.ping_checkbox.setDisabled(True)
             self.grid_layout.addWidget(self.top_checkbox, row_index, 0)
             self.grid_layout.addWidget(QLabel("System name"), row_index, 1)
             self.grid_layout.addWidget(QLabel("Entry point"), row_index, 3)
             self.grid_layout.addWidget(self.ping_checkbox, row_index, 4)
             self.grid_layout.addWidget(QLabel("Last scan time"), row_index, 5)
+            self.grid_layout.addWidget(self.quick_checkbox, row_index, 6)
 
             # Connect top checkbox to other checkboxes
             self.top_checkbox.stateChanged.connect(self.top_checkbox_changed)
@@ -181,6 +199,17 @@ class MainWindow(QWidget):
             self.add_row_button.clicked.connect(self.add_row)
             top_layout.addWidget(self.add_row_button, stretch=0)
 
+            # Add a button to discover entry points
+            self.discover_button = QPushButton("Discover")
+            self.discover_button.setIcon(
+                QIcon(os.path.join(asset_dir, "plug-alt.png")))
+            self.discover_button.setIconSize(QSize(32, 32))
+            self.discover_button.setToolTip("Discover entry points by EtherNet/IP ListIdentity")
+            self.discover_button.setText("")
+            self.discover_button.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed)
+            self.discover_button.clicked.connect(self.discover_systems)
+            top_layout.addWidget(self.discover_button, stretch=0)
+
             # Add a button to save config
             self.save_config_button = QPushButton("Save config")
             self.save_config_button.setIcon(
@@ -216,6 +245,10 @@ class MainWindow(QWidget):
             spacer_hor = QWidget()
             top_layout.addWidget(spacer_hor, stretch=1)
 
+            # Scan queue depth and ETA
+            self.queue_label = QLabel("")
+            top_layout.addWidget(self.queue_label, stretch=0)
+
             # Add cog widget
             self.cog_widget = CogWidget(self.threadpool, os.path.join(asset_dir, "loading.gif"))
             top_layout.addWidget(self.cog_widget, stretch=0)
@@ -278,8 +311,15 @@ class MainWindow(QWidget):
 
     def view_data(self):
         saved_data_path = get_user_data_path()
-        data = load_data(saved_data_path)
-        self.view_data_window = preview_data.DataPreviewWidget(data)
+        if self.data_loader is not None:
+            self.data_loader.wait()  # interrupted when its window was closed
+        # The window opens at once, rows stream in from the loader thread
+        self.data_loader = DataLoader(saved_data_path, load_comments())
+        self.view_data_window = preview_data.DataPreviewWidget(self.data_loader.empty_frame())
+        self.data_loader.system_loaded.connect(self.view_data_window.append_data)
+        self.data_loader.progress.connect(self.view_data_window.loading_progress)
+        self.data_loader.finished.connect(self.view_data_window.loading_finished)
+        self.view_data_window.finished.connect(self.data_loader.requestInterruption)
 
         # Disable the main window (optional)
         self.setDisabled(True)
@@ -289,6 +329,7 @@ class MainWindow(QWidget):
 
         # **Connect to the 'finished' signal of the data preview window:**
         self.view_data_window.finished.connect(self.enable_main_window)
+        self.data_loader.start()
 
     def ping_checkbox_changed(self, state):
         print(f'Ping enabled {self.ping_checkbox.checkState()}')
@@ -309,31 +350,61 @@ class MainWindow(QWidget):
         if not len(self.system_name):
             QMessageBox.information(self, "No any system selected", f"Please, \nspecify at least one system to scan")
             return
-        else:
-            for i, current_system in enumerate(self.system_name):
-                if not self.checkboxes[i].isChecked():
-                    print(f"Skip {current_system.text()}")
-                    continue
-                try:
-                    print(f"Trying to scan {current_system.text()} via {self.entry_point[i].text()}...")
-                    running_scanner = Scanner(
-                        system_name=current_system.text(),
-                        entry_point=self.entry_point[i].text(),
-                        deep_scan=True,
-                    )
-                    # self.log_buttons[i].start_log()
-
-                    running_scanner.signals.start.connect(self.log_buttons[i].start_log)
-                    running_scanner.signals.finished.connect(self.system_finished)
-                    running_scanner.signals.progress.connect(self.update_progress)
-                    running_scanner.signals.module_found.connect(self.module_found)
-                    running_scanner.signals.cn_node_current.connect(self.cn_node_current)
-                    running_scanner.signals.communication_error.connect(self.communication_error)
-                    self.threadpool.start(running_scanner)
-                except SystemExit:
-                    print(f"Error scanning {current_system.text()}")
+        if ASYNC_SCAN_ENGINE:
+            self.start_async_scan()
+            return
+        if self.scheduler is None:
+            self.scheduler = ScanScheduler(self.threadpool,
+                                           gateway_limit=GATEWAY_SCAN_LIMIT,
+                                           requests_per_second=GATEWAY_REQUESTS_PER_SECOND)
+            self.scheduler.signals.start.connect(self.system_started)
+            self.scheduler.signals.finished.connect(self.system_finished)
+            self.scheduler.signals.progress.connect(self.update_progress)
+            self.scheduler.signals.module_found.connect(self.module_found)
+            self.scheduler.signals.cn_node_current.connect(self.cn_node_current)
+            self.scheduler.signals.communication_error.connect(self.communication_error)
+            self.scheduler.queue_changed.connect(self.queue_changed)
+        self.scheduler.quick = self.quick_checkbox.isChecked()
+        for i, current_system in enumerate(self.system_name):
+            if not self.checkboxes[i].isChecked():
+                print(f"Skip {current_system.text()}")
+                continue
+            print(f"Trying to scan {current_system.text()} via {self.entry_point[i].text()}...")
+            self.scheduler.add(current_system.text(), self.entry_point[i].text())
+        self.scheduler.start()
+
+    def queue_changed(self, waiting: int, running: int, eta: float):
+        if not waiting and not running:
+            self.queue_label.setText("")
             return
+        minutes, seconds = divmod(int(eta), 60)
+        self.queue_label.setText(f"Scanning {running}, queued {waiting}, ETA {minutes}:{seconds:02d}")
 
+    def start_async_scan(self):
+        """All checked systems are scanned by one asyncio engine"""
+        systems = []
+        for i, current_system in enumerate(self.system_name):
+            if not self.checkboxes[i].isChecked():
+                print(f"Skip {current_system.text()}")
+                continue
+            print(f"Trying to scan {current_system.text()} via {self.entry_point[i].text()}...")
+            systems.append((current_system.text(), self.entry_point[i].text()))
+        if not systems:
+            return
+        running_scanner = AsyncScanner(systems, deep_scan=True, quick=self.quick_checkbox.isChecked())
+        running_scanner.signals.start.connect(self.system_started)
+        running_scanner.signals.finished.connect(self.system_finished)
+        running_scanner.signals.progress.connect(self.update_progress)
+        running_scanner.signals.module_found.connect(self.module_found)
+        running_scanner.signals.cn_node_current.connect(self.cn_node_current)
+        running_scanner.signals.communication_error.connect(self.communication_error)
+        self.threadpool.start(running_scanner)
+
+    def system_started(self, system_name: str):
+        for i, current_system in enumerate(self.system_name):
+            if current_system.text() == system_name:
+                self.log_buttons[i].start_log()
+                break
 
     def system_finished(self, system_name: str):
         print(f'Scan finished: {system_name}')
@@ -433,6 +504,13 @@ class MainWindow(QWidget):
             print("Rejected!")
             return
 
+    def discover_systems(self):
+        discovery = DiscoveryDialog(self,
+                                    system_names_defined=[_.text() for _ in self.system_name],
+                                    entry_points_defined=[_.text() for _ in self.entry_point])
+        discovery.data_ready.connect(self.handle_data)
+        discovery.exec()
+
     def edit_row(self, index):
         edit_system = EditSystemDialog(parent=self,
                                        system_name=self.system_name[index].text(),
@@ -499,7 +577,8 @@ class MainWindow(QWidget):
         self.preview_buttons.append(QPushButton(f"Edit"))
         self.preview_buttons[-1].clicked.connect(lambda: self.edit_row(row_index - 1))
         # self.preview_buttons[-1].setDisabled(True)
-        self.log_buttons.append(LogWidget(viewer_title=f"{system_name} scanner log"))
+        self.log_buttons.append(LogWidget(viewer_title=f"{system_name} scanner log",
+                                          profile_fname=profile_fname(system_name)))
 
         self.checkboxes.append(QCheckBox())
         self.checkboxes[-1].setChecked(checked)
@@ -575,13 +654,10 @@ if __name__ == '__main__':
     # ic(os.name)
     # Get the data path
     data_path = get_user_data_path()
-    prev_data_path = data_path / 'prev'
 
     # Create the directory if it doesn't exist
     if not data_path.exists():
         data_path.mkdir(parents=True, exist_ok=True)
-    if not prev_data_path.exists():
-        prev_data_path.mkdir(parents=True, exist_ok=True)
 
     app = QApplication(sys.argv)
     app.setWindowIcon(QIcon(os.path.join(asset_dir, 'irt.ico')))
@@ -1,6 +1,5 @@
 import sys
 import time
-import platform
 
 
 from PyQt6.QtWidgets import (
@@ -9,10 +8,11 @@ from PyQt6.QtWidgets import (
     QLabel,
     QHBoxLayout,
 )
-from PyQt6.QtCore import QThread, pyqtSignal, QProcess
+from PyQt6.QtCore import QThread, pyqtSignal
 
-from PyQt6.QtCore import QTimer, QSize
+from PyQt6.QtCore import QSize
 from host_ping import ping
+from reachability import shared_monitor, host_of
 
 from serial_generator import StyleSheetGenerator
 
@@ -43,50 +43,38 @@ class PingWidget(QWidget):
 
         self.setLayout(square_layout)
 
-        # Initialize ping thread
-        # self.ping_thread = None
-        self.timer = None
-        self.ping_results = None
         self.current_ping_index = 0
         self._results = [None] * len(self.square_labels)
-
-        self.ping_proc = QProcess()
-        self.ping_proc.setProgram('ping')
+        self._host = None
 
     def start_ping(self, ip_address: str):
+        if self._host is not None:
+            self.stop_ping()
         self._ip_address = ip_address
-        system = platform.system()
-
-        # Windows
-        if system == "Windows":
-            arguments = ['-n', '1', '-w', '1', self._ip_address]
-        # Linux/macOS
-        else:
-            arguments = ['-c', '1', '-w', '1', self._ip_address]
-
-        self.ping_proc.setArguments(arguments)
-        self.ping_proc.finished.connect(self.ping_finished)
-        # self.ping_proc.start()
-
-        # Start the timer to update the progress bar
-        self.timer = QTimer()
-        # self.timer.
-        self.timer.timeout.connect(self.ping_proc.start)
-        self.timer.start(3000)
-
-    def ping_finished(self):
-        # pass
-        # print(".", end='')
-        success = bool(self.ping_proc.exitCode() == 0)  # True if ping is successful
-        self.update_square_label(success)
-
+        self._host = host_of(ip_address)
+        monitor = shared_monitor()
+        monitor.checked.connect(self.ping_finished)
+        monitor.subscribe(self._host)
+
+    def ping_finished(self, results: dict):
+        if self._host not in results:
+            return
+        latency = results[self._host]
+        self.update_square_label(latency is not None)  # True if ping is successful
+        self.setToolTip(self._latency_hint())
+
+    def _latency_hint(self) -> str:
+        answered = [ms for ms in shared_monitor().latency_history(self._host) if ms is not None]
+        if not answered:
+            return f"{self._host}: no answer"
+        return f"{self._host}: last {answered[-1]:.1f} ms, max {max(answered):.1f} ms"
 
     def stop_ping(self):
-        self.ping_proc.kill()
-        if self.timer is None:
-            pass
-        else:
-            self.timer.stop()
+        if self._host is not None:
+            monitor = shared_monitor()
+            monitor.checked.disconnect(self.ping_finished)
+            monitor.unsubscribe(self._host)
+            self._host = None
         self._results = [None] * len(self.square_labels)
         self.update_square_label(None)
 
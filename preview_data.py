@@ -3,6 +3,7 @@ import pickle
 import sys
 from pprint import pprint
 
+import numpy as np
 import pandas as pd
 import openpyxl
 
@@ -119,13 +120,11 @@ class ConfigureDialog(QDialog):
         sort_order = self.sort_order_combo.currentText()
 
         try:
+            column = self.data_model._data.columns.get_loc(sort_column)
             if sort_order == "Ascending":
-                self.data_model.filtered_data.sort_values(by=sort_column, inplace=True, ascending=True)
+                self.data_model.sort(column, Qt.SortOrder.AscendingOrder)
             else:
-                self.data_model.filtered_data.sort_values(by=sort_column, inplace=True, ascending=False)
-
-            self.data_model.layoutChanged.emit()
-            self.data_model.dataChanged.emit(QModelIndex(), QModelIndex())
+                self.data_model.sort(column, Qt.SortOrder.DescendingOrder)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Sorting failed: {e}")
 
@@ -179,6 +178,7 @@ class DataPreviewWidget(QWidget):
         # Create labels for row counts
         self.filtered_rows_label = QLabel("Filtered Rows: 0")
         self.total_rows_label = QLabel(f"Total Rows: {data.shape[0]}")
+        self.loading_label = QLabel("")
 
         top_buttons_layout = QHBoxLayout()
         top_buttons_layout.addWidget(self.configure_button)
@@ -205,6 +205,7 @@ class DataPreviewWidget(QWidget):
         row_count_layout = QHBoxLayout()
         row_count_layout.addWidget(self.filtered_rows_label)
         row_count_layout.addWidget(self.total_rows_label)
+        row_count_layout.addWidget(self.loading_label)
         layout.addLayout(row_count_layout)
 
         self.setLayout(layout)
@@ -226,12 +227,28 @@ class DataPreviewWidget(QWidget):
             self.data_model._apply_filter(column_index, saved_filter)
 
 
+    def append_data(self, data: pd.DataFrame):
+        """Adds rows of one more system while DataLoader streams them in"""
+        self.data_model.append_rows(data)
+        self.total_rows_label.setText(f"Total Rows: {self.data_model.total_row_count()}")
+
+    def loading_progress(self, done: int, total: int, system_name: str):
+        if total:
+            self.loading_label.setText(f"Loading {done} of {total} systems: {system_name}")
+        else:
+            self.loading_label.setText("Loading...")
+
+    def loading_finished(self):
+        self.data_model.flush_rows()
+        self.total_rows_label.setText(f"Total Rows: {self.data_model.total_row_count()}")
+        self.loading_label.setText("")
+
     def on_cell_clicked(self, index):
         if index.row() == 0:
             return
         row = index.row() - 1
         if index.column() in self._comment_columns:
-            serial_number = self.data_model.filtered_data.iloc[row, self.data_model.filtered_data.columns.get_loc('serial')]
+            serial_number = self.data_model.row_value(row, 'serial')
             if not serial_number:
                 return
 
@@ -375,7 +392,7 @@ class DataPreviewWidget(QWidget):
         self.data_model.clear_filters()
 
     def update_filtered_rows_count(self, topLeft, bottomRight, roles=None):
-        filtered_rows = self.data_model.rowCount(QModelIndex()) - 1  # Exclude filter row
+        filtered_rows = self.data_model.filtered_row_count()
         self.filtered_rows_label.setText(f"Filtered Rows: {filtered_rows}")
 
     def toggle_column_visibility(self, column_index, visible):
@@ -427,17 +444,158 @@ class DataPreviewWidget(QWidget):
                 QMessageBox.critical(self, "Error", f"Failed to export data: {e}")
 
 
+FETCH_ROWS = 500  # rows added to the view per fetchMore
+APPEND_ROWS = 5000  # streamed rows buffered at least before they are merged into the model
+
+
+def render_value(value) -> str:
+    """Cell text as the table shows it"""
+    if value is None:
+        return ""
+    if pd.isna(value):
+        return ""
+    if isinstance(value, (int, float)):
+        return f"{value:.0f}"  # Format integers as integers
+    return str(value)
+
+
+def render_column(column: pd.Series) -> np.ndarray:
+    """Cell texts of the whole column, rendered once"""
+    rendered = np.empty(len(column), dtype=object)
+    rendered[:] = [render_value(value) for value in column.tolist()]
+    return rendered
+
+
 class DataModel(QAbstractTableModel):
+    """
+    Table of modules with the filter row on top.
+    Cells are rendered to strings once, the view reads them by plain array index.
+    Filtering and sorting only reorder self._rows - positions of shown rows in self._data.
+    Filters match the rendered texts, so *EMPTY* means an empty cell as seen in the table.
+    Rows are handed to the view in FETCH_ROWS chunks while it scrolls.
+    Streamed rows are merged in batches at least as big as the model, so every row is copied a few times only.
+    """
+
     def __init__(self, data: pd.DataFrame, comment_in_columns = None):
         super().__init__()
         self._data = data
-        # Apply filters to _data
-        self.filtered_data = self._data  # no filters now
+        self._columns = [render_column(data.iloc[:, i]) for i in range(data.shape[1])]
+        self._row_labels = data.index.astype(str).to_numpy(dtype=object)
+        self._rows = np.arange(data.shape[0])  # no filters now
+        self._loaded = min(len(self._rows), FETCH_ROWS)
         self._filters = ['' for _ in range(data.shape[1])]
+        self._lower = [None for _ in range(data.shape[1])]  # lowercase cell texts, made on first filter
+        self._masks = [None for _ in range(data.shape[1])]  # (filter, rows matching it) per column
+        self._serial_rows = None  # {serial: positions of its rows in self._data}, made on first comment edit
+        self._sort = None  # (column, order) of the last sort, applied to appended rows too
+        self._appended = []  # frames streamed in, not merged yet
 
         self._comment_columns = comment_in_columns or []
         # self.highlighted = None
 
+    @property
+    def filtered_data(self) -> pd.DataFrame:
+        return self._data.iloc[self._rows]
+
+    def filtered_row_count(self) -> int:
+        return len(self._rows)
+
+    def total_row_count(self) -> int:
+        return self._data.shape[0] + sum(len(frame) for frame in self._appended)
+
+    def row_value(self, row: int, column_name: str):
+        """Raw value of the shown data row (filter row excluded)"""
+        return self._data.iat[self._rows[row], self._data.columns.get_loc(column_name)]
+
+    def _set_rows(self, rows: np.ndarray, keep_loaded: bool = False):
+        """
+        :param keep_loaded: rows are only added. Rows already handed to the view stay, so it keeps its scroll
+        """
+        self.layoutAboutToBeChanged.emit()
+        self._rows = rows
+        if not keep_loaded:
+            self._loaded = min(len(rows), FETCH_ROWS)
+        self.layoutChanged.emit()
+        if keep_loaded:
+            self._load_first_rows()
+        self.dataChanged.emit(QModelIndex(), QModelIndex())
+
+    def _load_first_rows(self):
+        """Hands the first FETCH_ROWS rows to the view if it has less of them"""
+        count = min(len(self._rows), FETCH_ROWS) - self._loaded
+        if count > 0:
+            self.beginInsertRows(QModelIndex(), self._loaded + 1, self._loaded + count)
+            self._loaded += count
+            self.endInsertRows()
+
+    def _extend_rows(self, rows: np.ndarray):
+        """Adds rows at the end of shown ones. Rows already handed to the view stay, so it keeps its scroll"""
+        self._rows = np.concatenate((self._rows, rows))
+        self._load_first_rows()
+        self.dataChanged.emit(QModelIndex(), QModelIndex())
+
+    def append_rows(self, data: pd.DataFrame):
+        """
+        Adds rows of data at the end, as DataLoader streams systems in.
+        Rows are buffered until there are APPEND_ROWS of them and at least as many as the model has
+        (see flush_rows), the first ones go to the view at once.
+        """
+        self._appended.append(data)
+        buffered = sum(len(frame) for frame in self._appended)
+        if not self._data.shape[0] or buffered >= max(APPEND_ROWS, self._data.shape[0]):
+            self.flush_rows()
+
+    def flush_rows(self):
+        """
+        Merges buffered rows into the model.
+        Only the new rows are rendered and filtered, cached texts and masks of the old ones are extended.
+        """
+        if not self._appended:
+            return
+        data = pd.concat(self._appended).reindex(columns=self._data.columns)
+        self._appended = []
+        start = self._data.shape[0]
+        self._data = pd.concat([self._data, data]) if start else data
+        self._columns = [np.concatenate((rendered, render_column(data.iloc[:, i])))
+                         for i, rendered in enumerate(self._columns)]
+        self._row_labels = np.concatenate((self._row_labels, data.index.astype(str).to_numpy(dtype=object)))
+        self._serial_rows = None
+        for i, lower in enumerate(self._lower):
+            if lower is not None:
+                added = pd.Series(self._columns[i][start:], dtype=object).str.lower().to_numpy()
+                self._lower[i] = np.concatenate((lower, added))
+
+        new_rows = np.arange(start, self._data.shape[0])
+        mask = np.ones(len(new_rows), dtype=bool)
+        for i, cached in enumerate(self._masks):
+            if cached is None or cached[1] is None:
+                continue
+            matched = self._match(i, cached[0], new_rows)
+            self._masks[i] = (cached[0], np.concatenate((cached[1], matched)))
+            mask &= matched
+        new_rows = new_rows[mask]
+
+        if not len(new_rows):
+            return
+        if self._sort is not None:
+            self.sort(*self._sort, rows=np.concatenate((self._rows, new_rows)), keep_loaded=True)
+        else:
+            self._extend_rows(new_rows)
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        return not parent.isValid() and self._loaded < len(self._rows)
+
+    def fetchMore(self, parent: QModelIndex):
+        if parent.isValid():
+            return
+        count = min(len(self._rows) - self._loaded, FETCH_ROWS)
+        if count <= 0:
+            return
+        # +1 for filter row
+        self.beginInsertRows(QModelIndex(), self._loaded + 1, self._loaded + count)
+        self._loaded += count
+        self.endInsertRows()
+
     def flags(self, index: QModelIndex) -> Qt.ItemFlag:
         if index.row() == 0:  # First row (filter row) is always editable
             return (
@@ -452,7 +610,7 @@ class DataModel(QAbstractTableModel):
             )
 
     def rowCount(self, index):
-        return self.filtered_data.shape[0] + 1  # +1 for filter row
+        return self._loaded + 1  # +1 for filter row
 
     def columnCount(self, index):
         return self._data.shape[1]
@@ -467,15 +625,8 @@ class DataModel(QAbstractTableModel):
                 return str(value)
         elif role == Qt.ItemDataRole.DisplayRole:
             # Handle out-of-bounds index
-            if index.row() - 1 < len(self.filtered_data):
-                value = self.filtered_data.iloc[index.row() - 1, index.column()]
-                if value is None:
-                    return ""
-                if pd.isna(value):
-                    return ""
-                if isinstance(value, (int, float)):
-                    return f"{value:.0f}"  # Format integers as integers
-                return str(value)
+            if index.row() <= self._loaded:
+                return self._columns[index.column()][self._rows[index.row() - 1]]
             else:
                 return ""  # Or return None if you prefer
 
@@ -489,12 +640,20 @@ class DataModel(QAbstractTableModel):
 
         return None
 
+    def _rows_of_serial(self, serial: str) -> np.ndarray:
+        if self._serial_rows is None:
+            self._serial_rows = self._data.groupby('serial', sort=False).indices
+        return self._serial_rows.get(serial, np.empty(0, dtype=np.intp))
+
     def setComment(self, serial: str, value: str):
         # Find all rows with the same serial number
-        matching_rows = self._data[self._data['serial'] == serial].index
+        matching_rows = self._rows_of_serial(serial)
 
         # Update the comment in all matching rows
-        self._data.loc[matching_rows, 'comment'] = value
+        comment_column = self._data.columns.get_loc('comment')
+        self._data.iloc[matching_rows, comment_column] = value
+        self._columns[comment_column][matching_rows] = render_value(value)
+        self._invalidate_column(comment_column)
         self._reapply_filters()
         global_data.current_comment_saver.set_comment(serial, value)
         global_data.current_comment_saver.save()
@@ -514,39 +673,95 @@ class DataModel(QAbstractTableModel):
         _unneeded_filter = self._filters[0]
         self._apply_filter(0, _unneeded_filter)
 
+    def _invalidate_column(self, column_index: int):
+        """Drops cached texts and mask of the column after its cells changed"""
+        self._lower[column_index] = None
+        self._masks[column_index] = None
+
+    def _lower_column(self, column_index: int) -> np.ndarray:
+        if self._lower[column_index] is None:
+            self._lower[column_index] = pd.Series(self._columns[column_index], dtype=object).str.lower().to_numpy()
+        return self._lower[column_index]
+
+    def _column_mask(self, column_index: int, filter_value: str):
+        """Rows matching filter of one column. None if the column is not filtered"""
+        if not filter_value:
+            return None
+        if filter_value == "*EMPTY*":
+            return self._columns[column_index] == ''
+        if filter_value == "*NOT_EMPTY*":
+            return self._columns[column_index] != ''
+
+        # Split filter values by space and apply OR logic
+        filter_terms = filter_value.lower().split()
+        if not filter_terms:
+            return None
+        lower = self._lower_column(column_index)
+        candidates = None
+        cached = self._masks[column_index]
+        if cached is not None and cached[1] is not None:
+            cached_terms = cached[0].lower().split() if cached[0] not in ("*EMPTY*", "*NOT_EMPTY*") else []
+            # every new term contains an old one - new matches are subset of the old ones
+            if cached_terms and all(any(old in term for old in cached_terms) for term in filter_terms):
+                candidates = np.flatnonzero(cached[1])
+        if candidates is None:
+            candidates = np.arange(len(lower))
+
+        mask = np.zeros(len(lower), dtype=bool)
+        mask[candidates[self._match(column_index, filter_value, candidates)]] = True
+        return mask
+
+    def _match(self, column_index: int, filter_value: str, candidates: np.ndarray) -> np.ndarray:
+        """Which of the candidate rows match filter of the column"""
+        if filter_value == "*EMPTY*":
+            return self._columns[column_index][candidates] == ''
+        if filter_value == "*NOT_EMPTY*":
+            return self._columns[column_index][candidates] != ''
+        values = pd.Series(self._lower_column(column_index)[candidates], dtype=object)
+        found = np.zeros(len(candidates), dtype=bool)
+        for term in filter_value.lower().split():
+            found |= values.str.contains(term, regex=False).to_numpy(dtype=bool)
+        return found
+
     def _apply_filter(self, column_index: int, filter_value: str):
-        """Applies a filter to the specified column."""
+        """
+        Applies a filter to the specified column.
+        Only the mask of this column is recomputed, masks of other columns are cached.
+        """
         self._filters[column_index] = filter_value
-        self.filtered_data = self._data.copy()  # Reset filtered data
+        self._masks[column_index] = (filter_value, self._column_mask(column_index, filter_value))
 
+        mask = np.ones(self._data.shape[0], dtype=bool)
         for i, filter_value in enumerate(self._filters):
-            if filter_value:
-                if filter_value == "*EMPTY*":
-                    # Filter for empty cells
-                    self.filtered_data = self.filtered_data[self.filtered_data.iloc[:, i].isnull() & (self.filtered_data.iloc[:, i].astype(str).str.strip() == '')]
-                elif filter_value == "*NOT_EMPTY*":
-                    # Filter for non-empty cells
-                    self.filtered_data = self.filtered_data[~self.filtered_data.iloc[:, i].isnull()]
-                else:
-                    # Split filter values by space and apply OR logic
-                    filter_terms = filter_value.split()
-                    if filter_terms:
-                        filter_mask = False
-                        for term in filter_terms:
-                            filter_mask = filter_mask | self.filtered_data.iloc[:, i].astype(str).str.contains(term,
-                                                                                                               case=False,
-                                                                                                               regex=False)
-                            # print(term)
-                        self.filtered_data = self.filtered_data[filter_mask]
-
-        self.layoutChanged.emit()
-        self.dataChanged.emit(QModelIndex(), QModelIndex())
+            if not filter_value:
+                continue
+            if self._masks[i] is None or self._masks[i][0] != filter_value:  # filters restored from settings
+                self._masks[i] = (filter_value, self._column_mask(i, filter_value))
+            if self._masks[i][1] is not None:
+                mask &= self._masks[i][1]
+
+        self._sort = None
+        self._set_rows(np.flatnonzero(mask))
+
+    def sort(self, column: int, order: Qt.SortOrder = Qt.SortOrder.AscendingOrder, rows: np.ndarray = None,
+             keep_loaded: bool = False):
+        """
+        Sorts shown rows by the column. Order is kept until the next filter change
+        :param rows: rows to sort and show instead of the shown ones
+        :param keep_loaded: rows are the shown ones and some more, the view keeps its scroll (see _set_rows)
+        """
+        rows = self._rows if rows is None else rows
+        values = self._data.iloc[rows, column].reset_index(drop=True)
+        ascending = order == Qt.SortOrder.AscendingOrder
+        positions = values.sort_values(ascending=ascending, kind='stable').index.to_numpy()
+        self._sort = (column, order)
+        self._set_rows(rows[positions], keep_loaded)
 
     def clear_filters(self):
         self._filters = ['' for _ in range(self._data.shape[1])]
-        self.filtered_data = self._data  # Reset filtered data
-        self.dataChanged.emit(QModelIndex(), QModelIndex())
-        self.layoutChanged.emit()
+        self._masks = [None for _ in range(self._data.shape[1])]
+        self._sort = None
+        self._set_rows(np.arange(self._data.shape[0]))  # Reset filtered data
 
     def headerData(self, section, orientation, role):
         # section is the index of the column/row.
@@ -557,8 +772,8 @@ class DataModel(QAbstractTableModel):
             if orientation == Qt.Orientation.Vertical:
                 if section == 0:  # Header for filter row
                     return "Filters ⟹"
-                elif section > 0:  # Headers for data rows
-                    return str(self.filtered_data.index[section - 1])
+                elif section <= self._loaded:  # Headers for data rows
+                    return self._row_labels[self._rows[section - 1]]
         # filtered by value in this column highlighted
         elif role == Qt.ItemDataRole.BackgroundRole and orientation == Qt.Orientation.Horizontal:
             try:
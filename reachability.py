@@ -0,0 +1,209 @@
+# One shared reachability monitor for all entry points instead of a ping process per host
+import errno
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from PyQt6.QtCore import QThread, pyqtSignal, QCoreApplication
+
+ENIP_PORT = 44818  # EtherNet/IP explicit messaging
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+def host_of(entry_point: str) -> str:
+    """IP address or host name of an entry point like '10.0.0.1/bp/2/cnet/3'"""
+    return entry_point.strip().split('/', 1)[0]
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def _icmp_socket():
+    """Unprivileged ICMP socket, None if the OS does not allow it (then TCP connect is used)"""
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    except (OSError, AttributeError):
+        return None
+    sock.setblocking(False)
+    return sock
+
+
+def _icmp_message(reply: bytes) -> bytes:
+    """ICMP message of a datagram. Linux gives the message alone, macOS gives it after the IPv4 header"""
+    if reply and reply[0] >> 4 == 4:  # IP version 4, ICMP type would be 0 (echo reply)
+        return reply[(reply[0] & 0x0F) * 4:]
+    return reply
+
+
+def _resolve(host: str):
+    try:
+        return socket.gethostbyname(host)
+    except OSError:
+        return None
+
+
+def probe_hosts(hosts, timeout: float = 1.0, use_icmp: bool = True) -> dict:
+    """
+    Probes all hosts at once from one selector loop.
+    ICMP echo where allowed, otherwise TCP connect to EtherNet/IP port - refused connection means host is up.
+    Raises PermissionError if ICMP socket opens but sending is not allowed, probe again with use_icmp=False.
+    :return: {host: round trip in ms or None if no answer}
+    """
+    results = {host: None for host in hosts}
+    addresses = {host: _resolve(host) for host in hosts}
+    icmp = _icmp_socket() if use_icmp else None
+    selector = selectors.DefaultSelector()
+    sent = {}  # ICMP sequence or TCP socket: (host, start time)
+    try:
+        if icmp is not None:
+            selector.register(icmp, selectors.EVENT_READ)
+            for seq, (host, address) in enumerate(addresses.items(), start=1):
+                if address is None:
+                    continue
+                header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, os.getpid() & 0xffff, seq)
+                payload = b'CIP Inventory'
+                packet = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, _checksum(header + payload),
+                                     os.getpid() & 0xffff, seq) + payload
+                try:
+                    icmp.sendto(packet, (address, 0))
+                except PermissionError:
+                    raise
+                except OSError:
+                    continue
+                sent[seq] = (host, time.perf_counter())
+        else:
+            for host, address in addresses.items():
+                if address is None:
+                    continue
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                code = sock.connect_ex((address, ENIP_PORT))
+                if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                    sock.close()
+                    continue
+                selector.register(sock, selectors.EVENT_WRITE)
+                sent[sock] = (host, time.perf_counter())
+
+        deadline = time.perf_counter() + timeout
+        while sent:
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                break
+            for key, _ in selector.select(left):
+                if icmp is not None:
+                    try:
+                        reply, _ = icmp.recvfrom(1024)
+                    except OSError:
+                        continue
+                    reply = _icmp_message(reply)
+                    if len(reply) < 8 or reply[0] != ICMP_ECHO_REPLY:
+                        continue
+                    seq = struct.unpack('!H', reply[6:8])[0]
+                    if seq in sent:
+                        host, start = sent.pop(seq)
+                        results[host] = (time.perf_counter() - start) * 1000
+                else:
+                    sock = key.fileobj
+                    host, start = sent.pop(sock)
+                    selector.unregister(sock)
+                    error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if error in (0, errno.ECONNREFUSED):  # refused is an answer of a living host
+                        results[host] = (time.perf_counter() - start) * 1000
+                    sock.close()
+    finally:
+        for key in list(selector.get_map().values()):
+            if key.fileobj is not icmp:
+                key.fileobj.close()
+        selector.close()
+        if icmp is not None:
+            icmp.close()
+    return results
+
+
+class ReachabilityMonitor(QThread):
+    """
+    Probes all subscribed hosts every interval from one thread.
+    Results of a round go out in one signal, so every PingWidget picks its own host.
+
+    Signals:
+        checked (dict): {host: round trip in ms or None if no answer}
+    """
+    checked = pyqtSignal(dict)
+
+    def __init__(self, interval: float = 3.0, timeout: float = 1.0, history: int = 20):
+        super().__init__()
+        self.interval = interval
+        self.timeout = timeout
+        self._history_len = history
+        self._subscribers = {}  # host: number of widgets
+        self._history = {}  # host: deque of round trips
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._use_icmp = True
+
+    def subscribe(self, host: str):
+        with self._lock:
+            self._subscribers[host] = self._subscribers.get(host, 0) + 1
+            self._history.setdefault(host, deque(maxlen=self._history_len))
+
+    def unsubscribe(self, host: str):
+        with self._lock:
+            left = self._subscribers.get(host, 0) - 1
+            if left > 0:
+                self._subscribers[host] = left
+            else:
+                self._subscribers.pop(host, None)
+
+    def latency_history(self, host: str) -> list:
+        """Last round trips of the host in ms, None for lost probes"""
+        with self._lock:
+            return list(self._history.get(host, ()))
+
+    def run(self):
+        self._stop.clear()
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            with self._lock:
+                hosts = list(self._subscribers)
+            if hosts:
+                try:
+                    results = probe_hosts(hosts, self.timeout, self._use_icmp)
+                except PermissionError:  # ICMP socket opens but sending is not allowed
+                    self._use_icmp = False
+                    continue
+                with self._lock:
+                    for host, latency in results.items():
+                        if host in self._history:
+                            self._history[host].append(latency)
+                self.checked.emit(results)
+            self._stop.wait(max(0.0, self.interval - (time.perf_counter() - started)))
+
+    def stop(self):
+        self._stop.set()
+        self.wait()
+
+
+_monitor = None
+
+
+def shared_monitor() -> ReachabilityMonitor:
+    """Monitor shared by all widgets, started on first use and stopped when application quits"""
+    global _monitor
+    if _monitor is None:
+        _monitor = ReachabilityMonitor()
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(_monitor.stop)
+        _monitor.start()
+    return _monitor
@@ -0,0 +1,178 @@
+# Append-only journal of a running scan, so found modules are on disk as soon as they are found
+import json
+import os
+import threading
+import time
+
+from global_data import column_value
+from saver import get_user_data_path
+
+BYTES_TAG = '__bytes__'
+
+
+def _encoded(value):
+    """JSON form of values json does not know. Bytes are tagged, so they come back as bytes (see _decoded)"""
+    if isinstance(value, (bytes, bytearray)):
+        return {BYTES_TAG: value.hex()}
+    return column_value(value)
+
+
+def _decoded(obj: dict):
+    if len(obj) == 1 and BYTES_TAG in obj:
+        return bytes.fromhex(obj[BYTES_TAG])
+    return obj
+
+
+class ScanJournal(object):
+    """
+    Modules found by the scan of one system, one JSON record per line:
+        {"key": system path, "module": {...}}  or  {"cn_nodes": [...]}
+    Bytes values are written as {"__bytes__": hex} and read back as bytes.
+    Flushed every record and fsync'ed every sync_every records or sync_seconds.
+    A torn last line (power loss) is skipped when the journal is read.
+    Scanner removes the journal after its results are stored, so a journal left on disk
+    holds partial results of an interrupted scan.
+    """
+
+    def __init__(self, system_name: str, fname=None, sync_every: int = 50, sync_seconds: float = 5.0):
+        self._fname = fname or get_user_data_path() / 'journal' / f'{system_name}.journal'
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+        self._file = None
+        self._unsynced = 0
+        self._synced_at = 0.0
+        self._lock = threading.Lock()  # AsyncScanner finds modules of one system in many threads
+
+    def exists(self) -> bool:
+        return os.path.exists(self._fname)
+
+    def open(self, resume: bool = False):
+        """Starts new journal. resume: keep records of interrupted scan and append to them"""
+        os.makedirs(os.path.dirname(self._fname), exist_ok=True)
+        self._file = open(self._fname, 'a' if resume else 'w', encoding='utf-8')
+        self._synced_at = time.monotonic()
+        return self
+
+    def append(self, key: str, module: dict):
+        self._write({'key': key, 'module': module})
+
+    def append_cn_nodes(self, nodes: list):
+        self._write({'cn_nodes': nodes})
+
+    def _write(self, record: dict):
+        line = json.dumps(record, default=_encoded) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every or time.monotonic() - self._synced_at >= self.sync_seconds:
+                self._sync()
+
+    def _sync(self):
+        if self._file is None or not self._unsynced:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def records(self):
+        """Yields records in order they were written"""
+        try:
+            file = open(self._fname, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with file:
+            for line in file:
+                try:
+                    yield json.loads(line, object_hook=_decoded)
+                except json.JSONDecodeError:
+                    print(f"Broken record in {self._fname} skipped")
+
+    def restore(self, saver):
+        """Fills saver.module and saver.cn_nodes from the journal. Later record of the same module wins"""
+        saver.module = {}
+        saver.cn_nodes = []
+        for record in self.records():
+            if 'cn_nodes' in record:
+                saver.cn_nodes.append(record['cn_nodes'])
+            else:
+                saver.module[record['key']] = record['module']
+        return saver
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self._fname)
+        except FileNotFoundError:
+            pass
+
+
+class ScanCheckpoint(object):
+    """
+    Traversal frontier of a running scan, rewritten after every backplane and ControlNet done:
+        {"format": 2, "entry_point": ..., "saved": unix time, "pending": [task, ...],
+         "backplane_serial": [...], "controlnet_modules_serial": [...]}
+    task is ["bp", cip_path, level] or ["cn", bridge serial, cip_path, level].
+    backplane_serial are backplanes scanned already, backplanes of pending tasks are not among them.
+    Together with the journal it lets an interrupted scan go on from where it stopped.
+    """
+    FORMAT = 2  # format 1 listed backplanes of pending tasks as scanned
+
+    def __init__(self, system_name: str, fname=None, max_age: float = 24 * 3600):
+        """:param max_age: older checkpoint is not resumed, the system may have changed since"""
+        self._fname = fname or get_user_data_path() / 'journal' / f'{system_name}.checkpoint'
+        self.max_age = max_age
+
+    def save(self, entry_point: str, pending: list, backplane_serial: set, controlnet_modules_serial: set):
+        os.makedirs(os.path.dirname(self._fname), exist_ok=True)
+        state = {
+            'format': self.FORMAT,
+            'entry_point': entry_point,
+            'saved': time.time(),
+            'pending': pending,
+            'backplane_serial': sorted(backplane_serial),
+            'controlnet_modules_serial': sorted(controlnet_modules_serial),
+        }
+        tmp_fname = f'{self._fname}.tmp'
+        with open(tmp_fname, 'w', encoding='utf-8') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_fname, self._fname)
+
+    def load(self, entry_point: str):
+        """State saved by interrupted scan via the same entry point, None if nothing to resume"""
+        try:
+            with open(self._fname, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Broken checkpoint {self._fname}: {e}")
+            return None
+        if state.get('format') != self.FORMAT:
+            return None
+        if state.get('entry_point') != entry_point or time.time() - state.get('saved', 0) > self.max_age:
+            return None
+        if not state.get('pending'):
+            return None
+        return state
+
+    def remove(self):
+        try:
+            os.remove(self._fname)
+        except FileNotFoundError:
+            pass
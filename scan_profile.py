@@ -0,0 +1,145 @@
+# Where scan time goes: every CIP request of a scan timed, summed up in a report at the end
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from pycomm3.exceptions import CommError
+
+import cip_request
+from saver import get_user_data_path
+
+# Profile of the scan running in this thread or asyncio task. Threads the scan starts get it via copy_context
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+OK = 'ok'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+
+
+def profile_fname(system_name: str):
+    """Report of the last scan, next to the system's .data file"""
+    return get_user_data_path() / f'{system_name}.profile.txt'
+
+
+def _code(value) -> int:
+    """Service or class code as int. cip_request has both ints and pycomm3 bytes"""
+    return int.from_bytes(value, 'little') if isinstance(value, bytes) else int(value)
+
+
+def segment(cip_path: str) -> str:
+    """Route without its last link, like HopTimeouts does: all slots of a backplane, all nodes of a ControlNet"""
+    return cip_path.rsplit('/', 1)[0] if '/' in cip_path else cip_path
+
+
+def reply_outcome(response) -> str:
+    """Outcome of a reply. A bridge which timed out waiting for the target replies with error, not silence"""
+    if response:
+        return OK
+    if cip_request.error_in(response.error, cip_request.timeout_errors):
+        return TIMEOUT
+    return ERROR
+
+
+def record(cip_path: str, request: dict, outcome: str, seconds: float):
+    """Adds request to the profile of the running scan, if any"""
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add(cip_path, request, outcome, seconds)
+
+
+def timed_message(driver, cip_path: str, request: dict):
+    """driver.generic_message(**request), recorded to the profile of the running scan. CommError is a timeout too"""
+    start = time.perf_counter()
+    try:
+        response = driver.generic_message(**request)
+    except CommError:
+        record(cip_path, request, TIMEOUT, time.perf_counter() - start)
+        raise
+    except Exception:
+        record(cip_path, request, ERROR, time.perf_counter() - start)
+        raise
+    record(cip_path, request, reply_outcome(response), time.perf_counter() - start)
+    return response
+
+
+class ScanProfile(object):
+    """
+    Requests of one scan: (cip_path, service, class, outcome, seconds), and time spent in backplane walks
+    and ControlNet sweeps. AsyncScanner walks many backplanes at once, so phase times are summed over threads
+    and may exceed wall time.
+    """
+
+    def __init__(self, system_name: str):
+        self.system_name = system_name
+        self.requests = []
+        self.phases = {}  # phase: [count, seconds]
+        self.started = time.perf_counter()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add(self, cip_path: str, request: dict, outcome: str, seconds: float):
+        entry = (cip_path, _code(request['service']), _code(request['class_code']), outcome, seconds)
+        with self._lock:
+            self.requests.append(entry)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                count, seconds = self.phases.get(name, (0, 0.0))
+                self.phases[name] = [count + 1, seconds + time.perf_counter() - start]
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def report(self, top: int = 10) -> str:
+        with self._lock:
+            requests = list(self.requests)
+            phases = dict(self.phases)
+        wall = (self.finished or time.perf_counter()) - self.started
+        outcomes = {OK: 0, ERROR: 0, TIMEOUT: 0}
+        segments = {}  # segment: [requests, seconds, max seconds, timeouts]
+        for cip_path, _, _, outcome, seconds in requests:
+            outcomes[outcome] += 1
+            stats = segments.setdefault(segment(cip_path), [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            stats[3] += outcome == TIMEOUT
+
+        lines = [
+            f'Scan profile of {self.system_name}',
+            f'{len(requests)} requests in {wall:.1f} s: '
+            f'{outcomes[OK]} ok, {outcomes[ERROR]} error, {outcomes[TIMEOUT]} timeout',
+            '',
+            'Time split:',
+        ]
+        for name, (count, seconds) in sorted(phases.items()):
+            lines.append(f'  {name:<12} {count:>5} x {seconds:>9.2f} s')
+
+        lines += ['', f'Slowest hops (mean latency per segment, top {top}):',
+                  f'  {"mean ms":>9} {"max ms":>9} {"requests":>8} {"timeouts":>8}  segment']
+        by_mean = sorted(segments.items(), key=lambda item: item[1][1] / item[1][0], reverse=True)
+        for name, (count, seconds, longest, timeouts) in by_mean[:top]:
+            lines.append(f'  {seconds / count * 1000:>9.1f} {longest * 1000:>9.1f} {count:>8} {timeouts:>8}  {name}')
+
+        timed_out = sorted(((stats[3], name) for name, stats in segments.items() if stats[3]), reverse=True)
+        lines += ['', 'Timeouts per segment:']
+        lines += [f'  {timeouts:>8}  {name}' for timeouts, name in timed_out] or ['  none']
+
+        lines += ['', f'Slowest requests (top {top}):', f'  {"ms":>9} {"outcome":<8} service class  path']
+        for cip_path, service, class_code, outcome, seconds in sorted(requests, key=lambda r: r[4], reverse=True)[:top]:
+            lines.append(f'  {seconds * 1000:>9.1f} {outcome:<8} 0x{service:02x}    0x{class_code:02x}   {cip_path}')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, fname=None):
+        fname = fname or profile_fname(self.system_name)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, 'w', encoding='utf-8') as file:
+            file.write(self.report())
+        return fname
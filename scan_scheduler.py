@@ -0,0 +1,152 @@
+# Runs scans of many systems, not more than gateway_limit of them through the same gateway
+import os
+import pickle
+import time
+
+from PyQt6.QtCore import QObject, pyqtSignal, QThreadPool, QTimer
+
+from scanner import Scanner, ScannerSignals
+from scanner_lib import gateway_rate, split_cip_path
+from topology_cache import TopologyCache
+from saver import get_user_data_path
+
+DEFAULT_SCAN_SECONDS = 60  # expected duration of a system never scanned before
+
+
+class ScanJob(object):
+    """
+    One system to scan.
+
+    Attributes:
+        gateways (set): entry point IP and ControlNet bridges (by serial) the scan goes through,
+                        as known from the topology cache of the last scan
+        expected (float): expected duration in seconds
+    """
+
+    def __init__(self, system_name: str, entry_point: str, expected: float):
+        self.system_name = system_name
+        self.entry_point = entry_point
+        self.expected = expected
+        self.started = None
+        topology = TopologyCache(system_name).load()
+        self.gateways = {split_cip_path(entry_point)[0], *(f'cnet:{serial}' for serial in topology.bridges)}
+
+
+class ScanHistory(object):
+    """Durations of the last successful scans, {system name: seconds}. Pickled in user data"""
+
+    def __init__(self, fname=None):
+        self._fname = fname or get_user_data_path() / 'scan_history.pkl'
+        self.durations = {}
+
+    def load(self):
+        try:
+            with open(self._fname, 'rb') as file:
+                self.durations = pickle.load(file)
+        except FileNotFoundError:
+            pass
+        except (pickle.PickleError, EOFError) as e:
+            print(f"Broken scan history {self._fname}: {e}")
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self._fname), exist_ok=True)
+        with open(self._fname, 'wb') as file:
+            pickle.dump(self.durations, file)
+
+    def expected(self, system_name: str) -> float:
+        if system_name in self.durations:
+            return self.durations[system_name]
+        if self.durations:
+            return sum(self.durations.values()) / len(self.durations)
+        return DEFAULT_SCAN_SECONDS
+
+
+class ScanScheduler(QObject):
+    """
+    Queue of systems to scan in the thread pool.
+    Longest expected scans go first. A job starts when none of its gateways has gateway_limit scans running,
+    so systems sharing an entry point or a ControlNet bridge do not hammer it at once,
+    while jobs behind free gateways keep the pool busy.
+    Requests through every gateway are capped to requests_per_second (see scanner_lib.GatewayRateLimiter).
+
+    Scanners emit through self.signals, same as Scanner's own ScannerSignals.
+
+    Signals:
+        queue_changed (int, int, float): jobs waiting, jobs running, ETA of all in seconds
+    """
+    queue_changed = pyqtSignal(int, int, float)
+
+    def __init__(self, threadpool: QThreadPool, gateway_limit: int = 1, requests_per_second: float = None,
+                 quick: bool = False):
+        super().__init__()
+        self.threadpool = threadpool
+        self.gateway_limit = gateway_limit
+        self.quick = quick
+        self.signals = ScannerSignals()
+        self.signals.finished.connect(self._job_succeeded)
+        self.signals.stopped.connect(self._job_stopped)
+        self.history = ScanHistory().load()
+        self.pending = []
+        self.running = {}  # system name: ScanJob
+        self._busy = {}  # gateway: scans running through it
+        gateway_rate.set_rate(requests_per_second)
+        self._eta_timer = QTimer(self)
+        self._eta_timer.timeout.connect(self._emit_queue)
+
+    def add(self, system_name: str, entry_point: str):
+        if system_name in self.running or any(job.system_name == system_name for job in self.pending):
+            return  # scan of this system is queued already
+        self.pending.append(ScanJob(system_name, entry_point, self.history.expected(system_name)))
+        self.pending.sort(key=lambda job: job.expected, reverse=True)  # longest first
+
+    def start(self):
+        self._eta_timer.start(1000)
+        self._dispatch()
+
+    def _free(self, job: ScanJob) -> bool:
+        return all(self._busy.get(gateway, 0) < self.gateway_limit for gateway in job.gateways)
+
+    def _dispatch(self):
+        for job in list(self.pending):
+            if len(self.running) >= self.threadpool.maxThreadCount():
+                break
+            if not self._free(job):
+                continue
+            self.pending.remove(job)
+            self.running[job.system_name] = job
+            for gateway in job.gateways:
+                self._busy[gateway] = self._busy.get(gateway, 0) + 1
+            job.started = time.time()
+            self.threadpool.start(Scanner(job.system_name, job.entry_point, deep_scan=True,
+                                          signals=self.signals, quick=self.quick))
+        self._emit_queue()
+
+    def _job_succeeded(self, system_name: str):
+        job = self.running.get(system_name)
+        if job is not None:
+            self.history.durations[system_name] = time.time() - job.started
+            self.history.save()
+
+    def _job_stopped(self, system_name: str):
+        job = self.running.pop(system_name, None)
+        if job is None:
+            return
+        for gateway in job.gateways:
+            self._busy[gateway] -= 1
+        self._dispatch()
+
+    def eta(self) -> float:
+        """Seconds until all jobs are done, by list scheduling of expected durations over the pool"""
+        now = time.time()
+        slots = sorted(max(0.0, job.expected - (now - job.started)) for job in self.running.values())
+        slots += [0.0] * max(0, self.threadpool.maxThreadCount() - len(slots))
+        for job in self.pending:
+            slots.sort()
+            slots[0] += job.expected
+        return max(slots, default=0.0)
+
+    def _emit_queue(self):
+        if not self.pending and not self.running:
+            self._eta_timer.stop()
+        self.queue_changed.emit(len(self.pending), len(self.running), self.eta())
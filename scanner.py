@@ -1,4 +1,7 @@
+import asyncio
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 # from pathlib import Path
 from pprint import pprint
@@ -6,9 +9,14 @@ from pprint import pprint
 from PyQt6.QtCore import QThread, pyqtSignal, QRunnable, pyqtSlot, QObject
 from pycomm3 import ResponseError
 
-from scanner_lib import scan_cn, scan_bp, CommError, get_module_sn, get_backplane_sn
+from scanner_lib import scan_cn, scan_bp, CommError, gateway_of, capabilities, EntryPointSession, split_cip_path
 
 from global_data import global_data_cls
+from topology_cache import TopologyCache
+from inventory_store import InventoryStore
+from scan_journal import ScanJournal, ScanCheckpoint
+from scan_profile import ScanProfile, current_profile
+from snapshot_history import SnapshotHistory, RetentionPolicy
 from saver import get_user_data_path
 
 # global_data.restore_data()
@@ -89,27 +97,46 @@ class ScannerSignals(QObject):
     cn_node_current = pyqtSignal(str)
     communication_error = pyqtSignal(str)  # Signal if can't communicate
     module_found = pyqtSignal(dict)  # signal when found any module
+    stopped = pyqtSignal(str)  # System name. Scan is over, with or without success
 
 
 class Scanner(QRunnable):
-    def __init__(self, system_name: str, entry_point: str, deep_scan: bool = True):
+    def __init__(self, system_name: str, entry_point: str, deep_scan: bool = True, signals: ScannerSignals = None,
+                 quick: bool = False, resume: bool = True):
+        """
+        :param quick: quick rescan. Only slots and ControlNet nodes populated at the last scan are probed,
+            the whole backplane or ControlNet only if something differs
+        :param resume: if scan of this system via the same entry point was interrupted (see ScanCheckpoint),
+            go on from its frontier and keep modules it journaled. Otherwise scan starts from the entry point
+        """
         super().__init__()
         self.system_name = system_name
         self.entry_point = entry_point
         self.deep_scan = deep_scan
-        self.signals = ScannerSignals()
-        utc_time = datetime.now(timezone.utc).strftime(TIME_FORMAT)
-        fname = get_user_data_path() / 'prev' / f'{self.system_name}.{utc_time}.data'
-        self.saver = global_data_cls(fname=fname)
+        self.quick = quick
+        self.resume = resume
+        self.signals = signals or ScannerSignals()
+        self.topology = TopologyCache(system_name).load()
+        self.resumed = False  # interrupted scan goes on, backplanes it scanned before are not updated in topology
+        self.stamp = datetime.now(timezone.utc).strftime(TIME_FORMAT)  # of the snapshot in history
+        self.data_fname = get_user_data_path() / f'{self.system_name}.data'
+        self.saver = global_data_cls(fname=self.data_fname)
+        self.journal = ScanJournal(system_name)
+        self.checkpoint = ScanCheckpoint(system_name)
         self.controlnet_modules_serial = set()
         self.backplane_serial = set()
+        self._claim_lock = threading.Lock()  # AsyncScanner reaches one backplane via many bridges at once
+        self._claims = {}  # cip_path: serial of the backplane claimed there
+        self.pending = []  # traversal frontier, stack of tasks as ScanCheckpoint describes
+        self.session = None  # one session to the entry point for all backplanes of run(). AsyncScanner has none
+        self.profile = ScanProfile(system_name)
 
     def _emit_progress(self, message):
         self.signals.progress.emit(self.system_name, message)
 
     def _module_found(self, module: dict):
         key = self._add_system_info_to_module(module)
-        self.saver.module[key] = module
+        self.journal.append(key, module)
         self.signals.module_found.emit(module)
 
     def _add_system_info_to_module(self, module: dict):
@@ -119,42 +146,169 @@ class Scanner(QRunnable):
         module["system"] = self.system_name
         return system_path
 
+    def _open_journal(self):
+        """Opens the journal. Returns True if interrupted scan is resumed"""
+        state = self.checkpoint.load(self.entry_point) if self.resume else None
+        if state is None:
+            if self.journal.exists():
+                print(f"Partial results of interrupted scan of {self.system_name} dropped")
+            self.journal.open()
+            return False
+        self.pending = state['pending']
+        self.backplane_serial = set(state['backplane_serial'])
+        self.controlnet_modules_serial = set(state['controlnet_modules_serial'])
+        self.journal.open(resume=True)
+        self.resumed = True
+        self._emit_progress(f'Resume interrupted scan, {len(self.pending)} tasks pending')
+        return True
+
+    def _start_profile(self):
+        """Requests sent from now on in this thread (asyncio task) and threads it starts go to a new profile"""
+        self.profile = ScanProfile(self.system_name)
+        return current_profile.set(self.profile)
+
+    def _save_profile(self):
+        self.profile.finish()
+        fname = self.profile.save()
+        self._emit_progress(f'Scan profile saved in {fname}')
+
+    def _keep_partial_results(self):
+        self.journal.close()
+        capabilities.save()
+        self._save_profile()
+        self._emit_progress('Scan interrupted. Modules found so far are kept in the journal')
+
+    def _store_results(self):
+        """Finalizes the scan: data files are written from the journal, then the journal is dropped"""
+        self.journal.close()
+        self.journal.restore(self.saver)
+        self.saver.store_data()
+        history = SnapshotHistory(self.system_name)
+        history.append(self.stamp, self.saver.module, self.saver.cn_nodes)
+        history.apply_retention(RetentionPolicy().load())
+        InventoryStore().upsert_system(self.system_name, self.saver.module, self.data_fname)
+        if not self.quick and not self.resumed:
+            self.topology.prune()
+        self.topology.save()
+        capabilities.save()
+        self._save_profile()
+        self.journal.remove()
+        self.checkpoint.remove()
+        self.signals.finished.emit(self.system_name)
 
     @pyqtSlot()
     def run(self):
         self.signals.start.emit(self.system_name)
         self._emit_progress(f'Scanner start via Entry Point {self.entry_point}')
 
+        self.session = EntryPointSession(split_cip_path(self.entry_point)[0])
+        profile_token = self._start_profile()
         try:
-            self._scan_backplane(self.entry_point, 0)  # Start the recursive scan
+            if not self._open_journal():
+                self.pending = [['bp', self.entry_point, 0]]
+            self._walk()
 
         except CommError as e:
+            self._keep_partial_results()
             self.signals.communication_error.emit(f"Communication Error: {e}")
         except ResponseError as e:
+            self._keep_partial_results()
             self.signals.communication_error.emit(f"Response Error: {e}")
         except Exception as e:
+            self._keep_partial_results()
             self.signals.communication_error.emit(f"Unexpected Exception: {e}")
         else:
-            fname = get_user_data_path() / f'{self.system_name}.data'  # User data path
-            self.saver.store_data()
-            self.saver.store_data(filename=fname)
-            self.signals.finished.emit(self.system_name)
+            self._store_results()
         finally:
+            current_profile.reset(profile_token)  # pool thread runs other scans later
+            self.session.close()
+            self.session = None
             print(f"Scanner complete {self.system_name}")
-
-
-    def _scan_backplane(self, cip_path, level):
+            self.signals.stopped.emit(self.system_name)
+
+    def _claim_backplane(self, bp_sn, cip_path=None) -> bool:
+        """False if the backplane is scanned already, otherwise it is reserved for the caller at cip_path"""
+        with self._claim_lock:
+            if bp_sn in self.backplane_serial:
+                return False
+            self.backplane_serial.add(bp_sn)
+            self._claims[cip_path] = bp_sn
+            return True
+
+    def _save_checkpoint(self):
+        """
+        Saves the frontier. Backplanes claimed by pending tasks (still running in AsyncScanner) are not
+        listed as scanned, their tasks are repeated on resume
+        """
+        with self._claim_lock:
+            running = {self._claims.get(task[1]) for task in self.pending if task[0] == 'bp'}
+            scanned = self.backplane_serial - running
+        self.checkpoint.save(self.entry_point, self.pending, scanned, self.controlnet_modules_serial)
+
+    def _scan_one_backplane(self, cip_path, level):
+        """
+        Scans single backplane. Returns ControlNet bridges found {serial: cip_path},
+        None if the backplane is scanned already or can not be walked.
+        Behind ControlNet a node without backplane (drive, HMI...) or out of reach (CommError) is only logged,
+        its subtree is skipped and the walk goes on. Failure of the entry point itself ends the scan
+        """
         self._emit_progress(f'Scanning Backplane Level {level}: {cip_path}')
 
-        bp_sn, modules, bp, cn_path = scan_bp(
-            cip_path=cip_path,
-            p=lambda *args, **kwargs: self._emit_progress(' '.join(map(str, args))),  # Lambda for progress updates
-            module_found=self._module_found
-        )
-        self.backplane_serial.add(bp_sn)
-
-
-
+        try:
+            with self.profile.phase('backplane'):
+                result = scan_bp(
+                    cip_path=cip_path,
+                    p=lambda *args, **kwargs: self._emit_progress(' '.join(map(str, args))),  # Lambda for progress updates
+                    module_found=self._module_found,
+                    session=self.session,
+                    known_backplanes=self.topology.known_slots() if self.quick else None,
+                    claim_backplane=lambda bp_sn: self._claim_backplane(bp_sn, cip_path),
+                )
+        except Exception as e:
+            if not level:  # entry point itself
+                raise
+            self._emit_progress(f'Backplane behind {cip_path} skipped: {e}')
+            return None
+        if result is None:
+            return None
+        bp_sn, modules, bp, cn_path = result
+        self.topology.update_backplane(bp_sn, cip_path, bp['size'], modules)
+        return cn_path
+
+    def _sweep_controlnet(self, cn_serial, cn_cip_path):
+        """Sweeps ControlNet behind the bridge. Returns communication modules found {serial: cip_path}"""
+        with self.profile.phase('controlnet'):
+            controlnet_nodes, communication_modules_paths = scan_cn(
+                cn_cip_path,
+                p=lambda *args, **kwargs: self._emit_progress(' '.join(map(str, args))),
+                current_cn_node_update=self.signals.cn_node_current.emit,
+                known_nodes=self.topology.known_nodes(cn_serial) if self.quick else None,
+            )
+        self.journal.append_cn_nodes(controlnet_nodes)
+        self.topology.update_bridge(cn_serial, cn_cip_path, communication_modules_paths)
+        return communication_modules_paths
+
+    def _walk(self):
+        """
+        Walks the frontier depth first, same order as recursive scan would go.
+        Task leaves the frontier only when done, its subtasks come in its place, then the checkpoint is saved.
+        Interrupted task is repeated on resume, the journal keeps the latest record of a module.
+        """
+        while self.pending:
+            task = self.pending[-1]
+            if task[0] == 'bp':
+                subtasks = self._scan_backplane(*task[1:])
+            else:
+                subtasks = self._scan_controlnet(*task[1:])
+            self.pending.pop()
+            self.pending.extend(reversed(subtasks))
+            self._save_checkpoint()
+
+    def _scan_backplane(self, cip_path, level) -> list:
+        """Scans backplane. Returns tasks for ControlNet bridges found"""
+        cn_path = self._scan_one_backplane(cip_path, level)
+
+        subtasks = []
         if self.deep_scan and cn_path:
             self._emit_progress(f'Scanning ControlNet modules connected to Backplane Level {level}')
             for cn_serial, cn_cip_path in cn_path.items():
@@ -162,19 +316,154 @@ class Scanner(QRunnable):
                     continue  # Skip already scanned ControlNet modules
 
                 self.controlnet_modules_serial.add(cn_serial)
-                try:
-                    controlnet_nodes, communication_modules_paths = scan_cn(
-                        cn_cip_path,
-                        p=lambda *args, **kwargs: self._emit_progress(' '.join(map(str, args))),
-                        current_cn_node_update=self.signals.cn_node_current.emit
-                    )
-                    self.saver.cn_nodes.append(controlnet_nodes)
-
-                    for bp, path in communication_modules_paths.items():
-                        backplane_serial = get_backplane_sn(path)
-                        if backplane_serial and backplane_serial not in self.backplane_serial:
-                            self._scan_backplane(path, level + 1) # Recursive call for next level
-
-
-                except CommError as e:
-                    self._emit_progress(f"Error scanning ControlNet {cn_cip_path}: {e}")
\ No newline at end of file
+                subtasks.append(['cn', cn_serial, cn_cip_path, level])
+        return subtasks
+
+    def _scan_controlnet(self, cn_serial, cn_cip_path, level) -> list:
+        """
+        Sweeps ControlNet. Returns tasks for backplanes behind it.
+        A backplane seen via another bridge too is skipped by scan_bp after its first requests
+        """
+        subtasks = []
+        try:
+            communication_modules_paths = self._sweep_controlnet(cn_serial, cn_cip_path)
+
+            for bp, path in communication_modules_paths.items():
+                subtasks.append(['bp', path, level + 1])  # next level
+
+        except CommError as e:
+            self._emit_progress(f"Error scanning ControlNet {cn_cip_path}: {e}")
+        return subtasks
+
+
+class AsyncScanner(QRunnable):
+    """
+    Scans many systems in one worker thread with asyncio.
+    Backplanes and ControlNet bridges of all systems are scanned as concurrent tasks.
+    Blocking pycomm3 calls go to a thread pool of max_threads, at most gateway_limit of them
+    through the same gateway (entry point IP or ControlNet bridge) at once.
+    Emits the same ScannerSignals as Scanner, every signal carries the system name where Scanner's does.
+    Keeps the same journal and checkpoint as Scanner: the frontier is every task not done yet, running ones
+    included, so an interrupted run of either of them is resumed by the other one as well.
+    """
+
+    def __init__(self, systems, deep_scan: bool = True, gateway_limit: int = 2, max_threads: int = 16,
+                 quick: bool = False):
+        """
+        :param systems: [(system_name, entry_point), ...]
+        """
+        super().__init__()
+        self.signals = ScannerSignals()
+        self.scanners = [Scanner(system_name, entry_point, deep_scan, signals=self.signals, quick=quick)
+                         for system_name, entry_point in systems]
+        self.gateway_limit = gateway_limit
+        self.max_threads = max_threads
+        self._gateways = {}
+        self._in_flight = {}  # scanner: blocking calls running in the thread pool
+
+    @pyqtSlot()
+    def run(self):
+        asyncio.run(self._scan_all())
+
+    async def _scan_all(self):
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=self.max_threads))
+        await asyncio.gather(*(self._scan_system(scanner) for scanner in self.scanners))  # systems fail apart
+
+    async def _blocking(self, scanner: Scanner, gateway, func, *args):
+        """
+        Runs blocking func in the thread pool, respecting concurrency limit of gateway.
+        Cancelled caller does not stop the thread, so the call is kept in self._in_flight to wait for it
+        """
+        if gateway not in self._gateways:
+            self._gateways[gateway] = asyncio.Semaphore(self.gateway_limit)
+        async with self._gateways[gateway]:
+            work = asyncio.ensure_future(asyncio.to_thread(func, *args))
+            in_flight = self._in_flight.setdefault(scanner, set())
+            in_flight.add(work)
+            work.add_done_callback(in_flight.discard)
+            return await asyncio.shield(work)
+
+    async def _scan_system(self, scanner: Scanner):
+        self.signals.start.emit(scanner.system_name)
+        scanner._emit_progress(f'Scanner start via Entry Point {scanner.entry_point}')
+        profile_token = scanner._start_profile()  # context of this task, blocking calls get a copy of it
+
+        try:
+            if not scanner._open_journal():
+                scanner.pending = [['bp', scanner.entry_point, 0]]
+            await self._walk(scanner)
+
+        except CommError as e:
+            scanner._keep_partial_results()
+            self.signals.communication_error.emit(f"Communication Error: {e}")
+        except ResponseError as e:
+            scanner._keep_partial_results()
+            self.signals.communication_error.emit(f"Response Error: {e}")
+        except Exception as e:
+            scanner._keep_partial_results()
+            self.signals.communication_error.emit(f"Unexpected Exception: {e}")
+        else:
+            await asyncio.to_thread(scanner._store_results)
+        finally:
+            current_profile.reset(profile_token)
+            print(f"Scanner complete {scanner.system_name}")
+            self.signals.stopped.emit(scanner.system_name)
+
+    async def _walk(self, scanner: Scanner):
+        """
+        Runs all pending tasks of the system at once.
+        If one fails, the others are cancelled and blocking calls still running are waited for,
+        so nothing is written to the journal after the failure closes it
+        """
+        try:
+            await self._all(self._scan_backplane(scanner, task) if task[0] == 'bp'
+                            else self._scan_controlnet(scanner, task)
+                            for task in list(scanner.pending))
+        except BaseExceptionGroup as group_error:
+            await asyncio.gather(*self._in_flight.get(scanner, ()), return_exceptions=True)
+            error = group_error
+            while isinstance(error, BaseExceptionGroup):  # groups nest as tasks do
+                error = error.exceptions[0]
+            raise error
+
+    @staticmethod
+    async def _all(coroutines):
+        """Runs coroutines at once. Unlike gather, one failing cancels all the others and waits for them"""
+        async with asyncio.TaskGroup() as group:
+            for coroutine in coroutines:
+                group.create_task(coroutine)
+
+    @staticmethod
+    def _task_done(scanner: Scanner, task: list, subtasks: list):
+        """Task leaves the frontier, its subtasks come in, then the checkpoint is saved"""
+        scanner.pending.remove(task)
+        scanner.pending.extend(subtasks)
+        scanner._save_checkpoint()
+
+    async def _scan_backplane(self, scanner: Scanner, task: list):
+        _, cip_path, level = task
+        cn_path = await self._blocking(scanner, gateway_of(cip_path), scanner._scan_one_backplane, cip_path, level)
+
+        subtasks = []
+        if scanner.deep_scan and cn_path:
+            scanner._emit_progress(f'Scanning ControlNet modules connected to Backplane Level {level}')
+            for cn_serial, cn_cip_path in cn_path.items():
+                if cn_serial in scanner.controlnet_modules_serial:
+                    continue  # Skip already scanned ControlNet modules
+                scanner.controlnet_modules_serial.add(cn_serial)
+                subtasks.append(['cn', cn_serial, cn_cip_path, level])
+        self._task_done(scanner, task, subtasks)
+        await self._all(self._scan_controlnet(scanner, subtask) for subtask in subtasks)
+
+    async def _scan_controlnet(self, scanner: Scanner, task: list):
+        _, cn_serial, cn_cip_path, level = task
+        try:
+            communication_modules_paths = await self._blocking(scanner, cn_cip_path, scanner._sweep_controlnet,
+                                                               cn_serial, cn_cip_path)
+        except CommError as e:
+            scanner._emit_progress(f"Error scanning ControlNet {cn_cip_path}: {e}")
+            communication_modules_paths = {}
+
+        subtasks = [['bp', path, level + 1] for path in communication_modules_paths.values()]
+        self._task_done(scanner, task, subtasks)
+        await self._all(self._scan_backplane(scanner, subtask) for subtask in subtasks)
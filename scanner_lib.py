@@ -1,3 +1,8 @@
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 
 from pycomm3 import CIPDriver, Tag
@@ -11,6 +16,9 @@ from global_data import global_data, new_blank_module
 from shassy import MyModuleIdentityObject
 import cip_request
 import serial_generator
+from capability_cache import CapabilityCache
+from scan_profile import timed_message
+import scan_profile
 
 bp_all = set([])
 full_map = {}
@@ -21,9 +29,11 @@ controlnet_module = 22, 7, 8, 14
 flex_adapter = 37,
 ethernet_module = 166, 20, 58
 plc_module = 14,
+EMPTY_SLOTS_LIMIT = 3  # backplane of unknown size ends after so many empty slots in a row
 serial_unknown = serial_generator.SerialGenerator()
 
 long_path_error_values = b'\x18\x03\x01\x00', b'\x18\x03\x02\x00'  # empiric way
+CN_MAX_IN_FLIGHT = 4  # ControlNet nodes probed at once behind one bridge
 
 
 def flex_modules_decode(flex_respose):
@@ -55,37 +65,6 @@ def flex_modules_decode(flex_respose):
     return flex_modules
 
 
-def get_module_sn(cip_path):
-    driver: CIPDriver = CIPDriver(cip_path)
-    driver.open()
-    module_response = driver.generic_message(**cip_request.who)
-    if module_response.error:  # and module_response.value in long_path_error_values:
-        module_response = driver.generic_message(**cip_request.who_connected)
-        if module_response.error:
-            # raise ModuleUnavailable(cip_path)
-            return None
-    module = MyModuleIdentityObject.decode(module_response.value)
-    return module["serial"]
-
-
-def get_backplane_sn(cip_path):
-    driver: CIPDriver = CIPDriver(cip_path)
-    driver.open()
-    try:
-        bp_response = driver.generic_message(**cip_request.bp_info)
-        if bp_response.error:  # let's try another way
-            bp_response = driver.generic_message(**cip_request.bp_info_connected)
-            if bp_response.error:
-                # raise ModuleUnavailable(cip_path)
-                return None
-        bp = bp_response.value
-        serial = f'{bp['serial_no']:0>8x}'
-        return serial
-    except Exception as e:
-        print(e)
-        return None
-
-
 def path_left_strip(path: str) -> str:
     """
     10/20/30  --> 20/30
@@ -97,7 +76,289 @@ def path_left_strip(path: str) -> str:
         return f"/{'/'.join(_path)}"
 
 
-def scan_bp(cip_path, p=pprint, module_found=pprint):
+def split_cip_path(cip_path: str):
+    """
+    10.0.0.1/bp/2/cnet/3  --> ('10.0.0.1', 'bp/2/cnet/3')
+    """
+    ip, _, route = cip_path.partition('/')
+    return ip, route
+
+
+def gateway_of(cip_path: str) -> str:
+    """
+    ControlNet bridge (or entry point IP) the last hop of cip_path goes through
+    10.0.0.1/bp/2/cnet/3  --> 10.0.0.1/bp/2/cnet
+    10.0.0.1/bp/2         --> 10.0.0.1
+    """
+    head, cnet, _ = cip_path.rpartition('/cnet')
+    if cnet:
+        return head + cnet
+    return split_cip_path(cip_path)[0]
+
+
+def connected_message(cip_path, request: dict):
+    """Connected requests can't be routed over a shared session. Open own connection to cip_path"""
+    gateway_rate.acquire(cip_path)
+    with CIPDriver(cip_path) as driver:
+        return timed_message(driver, cip_path, request)
+
+
+def answered_message(driver, cip_path, request_name: str, variants: list, identity: dict = None):
+    """
+    Sends variants [(variant, cip_request dict), ...] of one request until one is answered,
+    the variant known to work first (see capabilities). Answered variant is recorded.
+    Where none was answered, only the first variant is sent next time.
+    :return: response of the answered variant, else of the last one sent
+    """
+    if capabilities.variant(request_name, cip_path, identity) == 'none':
+        variants = variants[:1]
+    response = None
+    for variant, request in capabilities.order(request_name, variants, cip_path, identity):
+        response = timed_message(driver, cip_path, request)
+        if response:
+            capabilities.record(request_name, variant, cip_path, identity)
+            return response
+    capabilities.record(request_name, 'none', cip_path, identity)
+    return response
+
+
+class HopTimeouts(object):
+    """
+    Unconnected Send timeouts learned per route segment.
+    Segment is the route without its last link, so all slots of one backplane or all nodes of one ControlNet
+    share it: 10.0.0.1/bp/2/cnet/3/bp/5 --> 10.0.0.1/bp/2/cnet/3/bp
+    RTT of successful replies gives tight timeout (RFC 6298 way: srtt + 4 * rttvar, times factor).
+    Until min_samples replies seen on a segment, it has no tight timeout and the long one is used.
+    """
+
+    def __init__(self, factor=2.0, min_ms=100, long_ms=5120, min_samples=3):
+        self.factor = factor
+        self.min_ms = min_ms
+        self.long_ms = long_ms
+        self.min_samples = min_samples
+        self._segments = {}  # segment: [samples, srtt, rttvar] in ms
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def segment(cip_path: str) -> str:
+        return cip_path.rpartition('/')[0]
+
+    def timeout_ms(self, cip_path: str):
+        """Tight timeout for request to cip_path, None if segment not learned yet"""
+        with self._lock:
+            stat = self._segments.get(self.segment(cip_path))
+        if stat is None or stat[0] < self.min_samples:
+            return None
+        samples, srtt, rttvar = stat
+        return int(min(self.long_ms, max(self.min_ms, self.factor * (srtt + 4 * rttvar))))
+
+    def record(self, cip_path: str, seconds: float):
+        """Register RTT of successful reply from cip_path"""
+        rtt = seconds * 1000
+        with self._lock:
+            stat = self._segments.get(self.segment(cip_path))
+            if stat is None:
+                self._segments[self.segment(cip_path)] = [1, rtt, rtt / 2]
+            else:
+                stat[0] += 1
+                stat[2] = 0.75 * stat[2] + 0.25 * abs(stat[1] - rtt)
+                stat[1] = 0.875 * stat[1] + 0.125 * rtt
+
+
+hop_timeouts = HopTimeouts()  # shared by all sessions of the process
+capabilities = CapabilityCache().load()  # request variants devices answer, saved by Scanner
+
+
+class GatewayRateLimiter(object):
+    """
+    Caps request rate through every gateway (entry point IP or ControlNet bridge, see gateway_of).
+    Token bucket per gateway: rate requests per second, up to burst at once after a pause.
+    No limit while rate is None.
+    """
+
+    def __init__(self, rate=None, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # gateway: [tokens, last refill time]
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self.rate = rate
+            if burst is not None:
+                self.burst = burst
+            self._buckets.clear()
+
+    def acquire(self, cip_path: str):
+        """Blocks until a request to cip_path is allowed"""
+        gateway = gateway_of(cip_path)
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return
+                now = time.monotonic()
+                tokens, last = self._buckets.get(gateway, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self._buckets[gateway] = (tokens - 1, now)
+                    return
+                self._buckets[gateway] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+
+gateway_rate = GatewayRateLimiter()  # shared by all scanners of the process, set by ScanScheduler
+
+
+class EntryPointSession(object):
+    """
+    One EtherNet/IP session (RegisterSession) to the entry point IP.
+    Every unconnected request to a module behind the entry point goes over this session,
+    only the route path of the request changes.
+    Empty slots and unused nodes are given up after tight timeout learned from the route segment (see HopTimeouts).
+    A path where a module was identified before (see capabilities) gets a second try with the long timeout,
+    so a module slower than its segment is not taken for an empty slot. A module gone from such a path costs
+    one long timeout, then the path is forgotten.
+    Every request waits for the rate limit of its gateway (see GatewayRateLimiter).
+    """
+
+    def __init__(self, ip: str, timeouts: HopTimeouts = hop_timeouts, rate: GatewayRateLimiter = gateway_rate):
+        self.ip = ip
+        self.timeouts = timeouts
+        self.rate = rate
+        self.driver = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def open(self):
+        self.driver = CIPDriver(self.ip)
+        self.driver.open()
+
+    def close(self):
+        if self.driver is None:
+            return
+        try:
+            self.driver.close()
+        except CommError:
+            pass
+        self.driver = None
+
+    def generic_message(self, request: dict, route: str, probe: bool = False) -> Tag:
+        """
+        Sends unconnected request to the module at route
+        :param request: one of cip_request dicts
+        :param route: route path relative to the entry point, like 'bp/2/cnet/3'. Empty for entry point itself
+        :param probe: there may be no module at route. Do not wait for it longer than the segment needs
+        """
+        timeout_ms = None
+        cip_path = f'{self.ip}/{route}'
+        if probe and route and self.timeouts:
+            timeout_ms = self.timeouts.timeout_ms(cip_path)
+        if timeout_ms:
+            try:
+                response = self._send(cip_request.unconnected_send(request, route, timeout_ms), route, request)
+            except CommError:
+                pass  # the only retry goes with the long timeout
+            else:
+                # bridge gave up waiting: retry only where a module was before, empty slots time out this way too
+                if response or not cip_request.error_in(response.error, cip_request.timeout_errors) \
+                        or not capabilities.known_path(cip_path):
+                    return response
+                response = self._send({**request, "route_path": route}, route, request)
+                if not response and cip_request.error_in(response.error, cip_request.route_errors):
+                    capabilities.forget_path(cip_path)
+                return response
+        return self._send({**request, "route_path": route or True}, route, request)
+
+    def _send(self, message: dict, route: str, request: dict) -> Tag:
+        """Sends message, request it carries goes to the scan profile"""
+        if self.driver is None:
+            self.open()
+        cip_path = f'{self.ip}/{route}' if route else self.ip
+        if self.rate:
+            self.rate.acquire(cip_path)
+        start = time.perf_counter()
+        try:
+            response = self.driver.generic_message(**message)
+        except CommError:
+            scan_profile.record(cip_path, request, scan_profile.TIMEOUT, time.perf_counter() - start)
+            # late reply of the failed request would be read as reply of the next one. Drop this session
+            self.close()
+            raise
+        seconds = time.perf_counter() - start
+        scan_profile.record(cip_path, request, scan_profile.reply_outcome(response), seconds)
+        if response and self.timeouts and route:
+            self.timeouts.record(cip_path, seconds)
+        return response
+
+
+def module_info(session: EntryPointSession, route: str):
+    """
+    Identity of the module at route, its program name and ControlNet address in one round trip
+    (Multiple Service Packet). Falls back to single who request if the module does not do MSP,
+    and sends only who to the modules known not to do it (see capabilities).
+    Most modules fail some of the services (a PLC has no ControlNet address), so their reply comes with
+    general status 0x1E. The module is there if its who reply succeeded. Only routing errors mean no module.
+    :return: (who response, {'plc_name': value, 'cn_address': value} of the replies that succeeded)
+    """
+    cip_path = f'{session.ip}/{route}' if route else session.ip
+
+    def who_only():
+        who_response = session.generic_message(cip_request.who, route, probe=True)
+        if who_response:
+            capabilities.record('module_info', 'who', cip_path)
+        return who_response, {}
+
+    if capabilities.variant('module_info', cip_path) == 'who':
+        return session.generic_message(cip_request.who, route, probe=True), {}
+    response = session.generic_message(cip_request.module_info, route, probe=True)
+    if not response:
+        error = response.error or ''
+        if not error or cip_request.error_in(error, cip_request.route_errors):
+            return response, {}  # no module there
+        if not (error.startswith(cip_request.msp_partial_error) and response.value):
+            return who_only()  # the module itself refused MSP, like "Service not supported"
+    try:
+        (who_status, who_data), (name_status, name_data), (cn_status, cn_data) = \
+            cip_request.parse_multiple_service(response.value)
+    except Exception as e:  # not MSP reply
+        print(f'Multiple Service Packet reply not parsed: {e}')
+        return who_only()
+    capabilities.record('module_info', 'msp', cip_path)
+    if who_status:
+        return Tag(cip_request.who['name'], None, None, f'Identity request failed ({who_status:0>2x})'), {}
+    details = {}
+    try:
+        if not name_status:
+            details['plc_name'] = cip_request.plc_name['data_type'].decode(name_data)
+        if not cn_status:
+            details['cn_address'] = cip_request.cn_address['data_type'].decode(cn_data)
+    except Exception as e:
+        print(f'Multiple Service Packet reply not decoded: {e}')
+    return Tag(cip_request.who['name'], who_data, None, None), details
+
+
+def scan_bp(cip_path, p=pprint, module_found=pprint, session: EntryPointSession = None, known_backplanes=None,
+            claim_backplane=None, empty_slots_limit: int = EMPTY_SLOTS_LIMIT):
+    """
+    Scan backplane behind cip_path slot by slot.
+    All slots are requested over one session to the entry point (own one if session not given)
+    :param known_backplanes: quick rescan. {backplane serial: {slot: module serial}} found before.
+        If this backplane is known, only its populated slots are probed. Whole backplane is probed
+        as soon as any of them differs.
+    :param claim_backplane: callable(backplane serial) -> bool, called as soon as the first requests tell
+        the serial. False if the backplane is scanned already (reached via another ControlNet), then
+        nothing more is requested and scan_bp returns None.
+    :param empty_slots_limit: backplane which does not tell its size (Point I/O, adapters) ends after
+        so many empty slots in a row, once past the size learned for this kind of adapter (see capabilities).
+        It ends at once where the adapter replies that the slot is beyond its bus.
+    """
     modules_in_bp = {}
     cn_modules_paths = {}
     this_flex_response = False
@@ -105,11 +366,13 @@ def scan_bp(cip_path, p=pprint, module_found=pprint):
     with CIPDriver(cip_path) as entry_point_module_driver:
         p(entry_point_module_driver)
 
-        entry_point_module = entry_point_module_driver.generic_message(**cip_request.who_connected)
+        entry_point_module = answered_message(entry_point_module_driver, cip_path, 'who', [
+            ('connected', cip_request.who_connected), ('unconnected', cip_request.who)])
         epm = MyModuleIdentityObject.decode(entry_point_module.value)
+        capabilities.remember_path(cip_path, epm)
         if epm['product_type#'] in communication_module:
             if epm['product_code'] in controlnet_module:
-                node_address_response = entry_point_module_driver.generic_message(**cip_request.cn_address)
+                node_address_response = timed_message(entry_point_module_driver, cip_path, cip_request.cn_address)
                 if node_address_response:
                     epm['cn_node'] = node_address_response.value['cn_node_number1']
                 else:
@@ -118,12 +381,13 @@ def scan_bp(cip_path, p=pprint, module_found=pprint):
                 pass
             if epm['product_code'] in flex_adapter:
                 try:
-                    this_flex_response = entry_point_module_driver.generic_message(**cip_request.flex_info)
+                    this_flex_response = timed_message(entry_point_module_driver, cip_path, cip_request.flex_info)
                     p(f'Flex adapter at {cip_path}')
                 except (ResponseError, CommError) as e:
                     p(f"Error communicating Flex ControlNet adapter {e}")
 
-        this_bp_response = entry_point_module_driver.generic_message(**cip_request.bp_info_connected)
+        this_bp_response = answered_message(entry_point_module_driver, cip_path, 'bp_info', [
+            ('connected', cip_request.bp_info_connected), ('unconnected', cip_request.bp_info)], epm)
         bp_as_module = new_blank_module()
 
         if this_bp_response.error:
@@ -139,6 +403,9 @@ def scan_bp(cip_path, p=pprint, module_found=pprint):
             bp_as_module["product_type"] = "Backplane"
             entry_point_module_in_bp_addr = -1
             bp_known_size = False
+            if claim_backplane and not claim_backplane(this_bp_sn):
+                p(f'Backplane {this_bp_sn} scanned already')
+                return None
             epm['path'] = path_left_strip(cip_path)
             epm['slot'] = None
             epm['product_name'] = tool.remove_control_chars(epm['product_name'])
@@ -148,6 +415,9 @@ def scan_bp(cip_path, p=pprint, module_found=pprint):
 
             bp_as_module["serial"] = f'{this_bp['serial_no']:0>8x}'
             this_bp_sn = bp_as_module["serial"]
+            if claim_backplane and not claim_backplane(this_bp_sn):
+                p(f'Backplane {this_bp_sn} scanned already')
+                return None
 
             bp_as_module["size"] = this_bp.get('size', None)
             bp_as_module["rev"] = f"{this_bp.get('major_rev', 0)}.{this_bp.get('minor_rev', 0)}"
@@ -184,148 +454,222 @@ def scan_bp(cip_path, p=pprint, module_found=pprint):
         backplane_size = 100
     else:
         backplane_size = bp_as_module["size"]
-    current_slot = -1
-    while True:
-        current_slot += 1
-        if current_slot == backplane_size:
-            break
-        real_path = f'{cip_path}/bp/{current_slot}'
-        path2save = path_left_strip(real_path)
 
-        if real_path == '11.120.66.1/bp/5/cnet/4/bp/0':  # and slot == 2:  # Exam: '192.168.0.124/bp/2/cnet/3'  '192.168.0.124'  '192.168.0.124/bp/2/cnet/3' 192.168.0.124/bp/2/cnet/1/bp/9
-            pass  # trap for debug. edit string above and set breakpoint here
-
-        if current_slot == entry_point_module_in_bp_addr:  # entry point module in this current_slot
-            epm['path'] = path2save
-            epm['slot'] = current_slot
-            epm['product_name'] = tool.remove_control_chars(epm['product_name'])
-            module_found(epm)
-            p(f"[{current_slot:0>2}] = {epm['product_name']}")
-            continue
+    slots_to_probe = list(range(backplane_size))
+    known_slots = None
+    if known_backplanes and bp_known_size:
+        known_slots = known_backplanes.get(this_bp_sn)
+    if known_slots is not None:
+        p(f'Quick rescan of known backplane {this_bp_sn}')
+        slots_to_probe = sorted({*known_slots, entry_point_module_in_bp_addr} - {-1})
+
+    def backplane_changed():
+        nonlocal known_slots
+        if known_slots is None:
+            return
+        p(f'Backplane {this_bp_sn} changed since last scan. Scanning all slots')
+        slots_to_probe.extend([slot for slot in range(backplane_size) if slot not in slots_to_probe])
+        known_slots = None
+
+    learned_size = 0 if bp_known_size else capabilities.learned_size(epm)
+    empty_run = 0
+
+    own_session = session is None
+    if own_session:
+        session = EntryPointSession(split_cip_path(cip_path)[0])
+    try:
+        probe_index = 0
+        while probe_index < len(slots_to_probe):
+            current_slot = slots_to_probe[probe_index]
+            probe_index += 1
+            real_path = f'{cip_path}/bp/{current_slot}'
+            path2save = path_left_strip(real_path)
+            _, route = split_cip_path(real_path)
+
+            if real_path == '11.120.66.1/bp/5/cnet/4/bp/0':  # and slot == 2:  # Exam: '192.168.0.124/bp/2/cnet/3'  '192.168.0.124'  '192.168.0.124/bp/2/cnet/3' 192.168.0.124/bp/2/cnet/1/bp/9
+                pass  # trap for debug. edit string above and set breakpoint here
+
+            if current_slot == entry_point_module_in_bp_addr:  # entry point module in this current_slot
+                epm['path'] = path2save
+                epm['slot'] = current_slot
+                epm['product_name'] = tool.remove_control_chars(epm['product_name'])
+                module_found(epm)
+                p(f"[{current_slot:0>2}] = {epm['product_name']}")
+                continue
 
-        try:
-            driver: CIPDriver = CIPDriver(real_path)
-            driver.open()
-            this_module_response = driver.generic_message(**cip_request.who)
-            # this_module_response = driver.generic_message(**cip_request.who_connected)
-            if this_module_response:  # this block executed for every real module ######################################
-                this_module = MyModuleIdentityObject.decode(this_module_response.value)
-
-                # if this_module["serial"] in modules_all:  # Check for communication loop
-                #     raise AlreadyScanned(this_module["serial"])
-                # else:
-                #     modules_all.add(this_module["serial"])
-
-                # _path = _long_path.split('/')[1:]
-                this_module["path"] = path_left_strip(path2save)
-                this_module["slot"] = current_slot
-                this_module["product_name"] = tool.remove_control_chars(this_module["product_name"])
-                modules_in_bp[current_slot] = this_module['serial']
-
-                module_serial_number = this_module['serial']
-                modules_all.add(module_serial_number)
-                # ----- log
-                p(f"[{current_slot:0>2}] = {this_module['product_name']}")
-
-                if this_module['product_type#'] in communication_module:
-                    if this_module['product_code'] in controlnet_module:
-                        node_address_response = driver.generic_message(**cip_request.cn_address)
-                        if node_address_response:
-                            this_module['cn_node'] = node_address_response.value['cn_node_number1']
-                        else:
-                            this_module['cn_node'] = 'UNKNOWN'
-                        p(f'+  <-- (controlnet module in slot {current_slot}. The way to access deep ControlNet)')
-                        cn_modules_paths[module_serial_number] = f'{cip_path}/bp/{current_slot}/cnet'
-
-                # Requests the name of the program running in the PLC. Uses KB `23341`_ for implementation.
-                if this_module['product_type#'] in plc_module:
-                    try:
-                        response: Tag = driver.generic_message(**cip_request.plc_name)
-                        if not response:
+            try:
+                this_module_response, details = module_info(session, route)
+                if this_module_response:  # this block executed for every real module ##################################
+                    this_module = MyModuleIdentityObject.decode(this_module_response.value)
+                    capabilities.remember_path(real_path, this_module)
+                    empty_run = 0
+
+                    this_module["path"] = path_left_strip(path2save)
+                    this_module["slot"] = current_slot
+                    this_module["product_name"] = tool.remove_control_chars(this_module["product_name"])
+                    modules_in_bp[current_slot] = this_module['serial']
+                    if known_slots is not None and known_slots.get(current_slot) != this_module['serial']:
+                        backplane_changed()
+
+                    module_serial_number = this_module['serial']
+                    modules_all.add(module_serial_number)
+                    # ----- log
+                    p(f"[{current_slot:0>2}] = {this_module['product_name']}")
+
+                    if this_module['product_type#'] in communication_module:
+                        if this_module['product_code'] in controlnet_module:
+                            if 'cn_address' in details:
+                                this_module['cn_node'] = details['cn_address']['cn_node_number1']
+                            else:
+                                node_address_response = connected_message(real_path, cip_request.cn_address)
+                                if node_address_response:
+                                    this_module['cn_node'] = node_address_response.value['cn_node_number1']
+                                else:
+                                    this_module['cn_node'] = 'UNKNOWN'
+                            p(f'+  <-- (controlnet module in slot {current_slot}. The way to access deep ControlNet)')
+                            cn_modules_paths[module_serial_number] = f'{cip_path}/bp/{current_slot}/cnet'
+
+                    # Requests the name of the program running in the PLC. Uses KB `23341`_ for implementation.
+                    if this_module['product_type#'] in plc_module:
+                        try:
+                            if 'plc_name' in details:
+                                response = Tag(cip_request.plc_name['name'], details['plc_name'], None, None)
+                            else:
+                                response: Tag = session.generic_message(cip_request.plc_name, route)
+                            this_module["name"] = response.value
+                            if not len(response.value):
+                                p(f'+  <-- program not loaded')
+                            else:
+                                p(f'+  <-- program: {response.value}')
+                        except Exception as err:
                             pass
-                        this_module["name"] = response.value
-                        if not len(response.value):
-                            p(f'+  <-- program not loaded')
-                        else:
-                            p(f'+  <-- program: {response.value}')
-                    except Exception as err:
-                        pass
-                        # this_module["name"] = None
+                            # this_module["name"] = None
 
-                if module_found:
-                    module_found(this_module)
-                driver.close()
-            else:
-                if bp_known_size:
-                    modules_in_bp[current_slot] = None
-                    empty_slot_as_module = new_blank_module()
-                    empty_slot_as_module["slot"] = current_slot
-                    empty_slot_as_module["product_name"] = "Empty slot"
-                    # empty_slot_as_module["serial"] = f'{this_bp_sn}-{slot:0>2}'
-                    empty_slot_as_module["path"] = path_left_strip(path2save)
-
-                    module_found(empty_slot_as_module)
-                    p(f"[{current_slot:0>2}] = ---")
-                    driver.close()
+                    if module_found:
+                        module_found(this_module)
                 else:
-                    # bp size unknown
-                    driver.close()
-                    if this_bp_response.value == b'\x12\x03\x00':  # communication module to PointIO chassy
-                        continue
-                    if this_bp_response.value == b'\x04\x02\x00': # no more PointIO modules
-                        break  # TODO
+                    if bp_known_size:
+                        backplane_changed()  # known module is gone
+                        modules_in_bp[current_slot] = None
+                        empty_slot_as_module = new_blank_module()
+                        empty_slot_as_module["slot"] = current_slot
+                        empty_slot_as_module["product_name"] = "Empty slot"
+                        empty_slot_as_module["path"] = path_left_strip(path2save)
+
+                        module_found(empty_slot_as_module)
+                        p(f"[{current_slot:0>2}] = ---")
+                    else:
+                        # bp size unknown
+                        empty_run += 1
+                        error = this_module_response.error or ''
+                        if cip_request.link_address_unavailable_error in error:
+                            p(f'[{current_slot:0>2}] is beyond the bus. No more modules')
+                            break
+                        if this_bp_response.value == b'\x04\x02\x00':  # no more PointIO modules
+                            break
+                        if current_slot >= learned_size and empty_run >= empty_slots_limit:
+                            p(f'{empty_run} empty slots in a row. No more modules')
+                            break
+                    continue
+            except ResponseError:
+                p(f"Error communicating {real_path}")
+                backplane_changed()
                 continue
-        except ResponseError:
-            p(f"Error communicating {real_path}")
-            driver.close()
-            continue
 
-        except CommError:
-            # raise CommError(f"Can't communicate to {real_path}!")
-            if not bp_known_size:
-                print(f"Can't communicate to {real_path}!     No more modules?")
-                driver.close()
-                break
+            except CommError:
+                # raise CommError(f"Can't communicate to {real_path}!")
+                backplane_changed()
+                if not bp_known_size:
+                    print(f"Can't communicate to {real_path}!     No more modules?")
+                    break
+    finally:
+        if own_session:
+            session.close()
+
+    populated = [slot for slot, serial in modules_in_bp.items() if serial]
+    if not bp_known_size and populated:
+        capabilities.learn_size(epm, max(populated) + 1)
+
+    if known_slots is not None:  # all known modules in place, the rest slots are empty as before
+        for current_slot in range(backplane_size):
+            if current_slot in slots_to_probe:
+                continue
+            modules_in_bp[current_slot] = None
+            empty_slot_as_module = new_blank_module()
+            empty_slot_as_module["slot"] = current_slot
+            empty_slot_as_module["product_name"] = "Empty slot"
+            empty_slot_as_module["path"] = path_left_strip(path_left_strip(f'{cip_path}/bp/{current_slot}'))
+            module_found(empty_slot_as_module)
     return this_bp_sn, modules_in_bp, bp_as_module, cn_modules_paths
 
 
-def scan_cn(cip_path, format='', exclude_bp_sn='', p=print, current_cn_node_update=None, max_node_num=99):
+def scan_cn(cip_path, format='', exclude_bp_sn='', p=print, current_cn_node_update=None, max_node_num=99,
+            max_in_flight=CN_MAX_IN_FLIGHT, known_nodes=None):
+    """
+    Sweep ControlNet node addresses 0..max_node_num behind the bridge at cip_path.
+    Up to max_in_flight nodes are probed at once, each worker keeps own session to the entry point.
+    The first CommError stops all workers after their current request, nodes not probed yet are dropped.
+    :param known_nodes: quick rescan. {node: module serial} found before. Only these nodes are probed,
+        the rest of addresses only if any of them differs.
+    """
     if current_cn_node_update:  # ---------------------------------------------logging function
         cn_node_updt = current_cn_node_update
     else:  # ---------------------------------------------------------------NO logging function
         def cn_node_updt(*args, **kwargs):
             pass
 
-    cn_modules_paths = {}
-    found_controlnet_nodes = []
     p(f'Scanning ControlNet {cip_path}...')
-    for cnet_node_num in range(max_node_num + 1):  # 100 for production
-        target = f'{cip_path}/{cnet_node_num}'
-        cn_node_updt(f'{cnet_node_num:02}')
-        # time.sleep(0.02)
+    ip, route = split_cip_path(cip_path)
+    found_serials = {}  # node number: module serial
+    failed = threading.Event()  # some worker got CommError, the sweep is given up
 
-        # print(f' Scan address {cnet_node_num}')
-        try:
-            driver = CIPDriver(target)
-            driver.open()
-            cn_module = driver.generic_message(**cip_request.who)
-            if cn_module.error:
-                # no module. CN address not in use
-                # print('.', end='')
-                pass
-            else:
+    def sweep(nodes_to_probe: queue.Queue):
+        with EntryPointSession(ip) as session:
+            while not failed.is_set():
+                try:
+                    cnet_node_num = nodes_to_probe.get_nowait()
+                except queue.Empty:
+                    return
+                cn_node_updt(f'{cnet_node_num:02}')
+                try:
+                    cn_module = session.generic_message(cip_request.who, f'{route}/{cnet_node_num}', probe=True)
+                except ResponseError:
+                    continue
+                except CommError:
+                    failed.set()
+                    raise
+                if cn_module.error:
+                    # no module. CN address not in use
+                    continue
                 p(f'{format} found node [{cnet_node_num:02}]')
                 m = MyModuleIdentityObject.decode(cn_module.value)
-                # p(m)
-                found_controlnet_nodes.append(cnet_node_num)
-                cn_modules_paths[m['serial']] = target
-            driver.close()
-        except ResponseError:
-            # print('.', end='')
-            driver.close()
+                capabilities.remember_path(f'{ip}/{route}/{cnet_node_num}', m)
+                found_serials[cnet_node_num] = m['serial']
+
+    def sweep_nodes(nodes):
+        nodes_to_probe = queue.Queue()
+        for cnet_node_num in nodes:
+            nodes_to_probe.put(cnet_node_num)
+        workers_num = max(1, min(max_in_flight, nodes_to_probe.qsize()))
+        with ThreadPoolExecutor(max_workers=workers_num) as pool:
+            workers = [pool.submit(contextvars.copy_context().run, sweep, nodes_to_probe)  # scan profile
+                       for _ in range(workers_num)]
+            for worker in workers:
+                worker.result()  # CommError from any worker goes to caller
+
+    all_nodes = range(max_node_num + 1)  # 100 for production
+    if known_nodes:
+        p(f'Quick rescan of {len(known_nodes)} known nodes')
+        sweep_nodes(sorted(known_nodes))
+        if found_serials != known_nodes:
+            p(f'ControlNet {cip_path} changed since last scan. Scanning all nodes')
+            sweep_nodes([node for node in all_nodes if node not in known_nodes])
+    else:
+        sweep_nodes(all_nodes)
+
+    found_controlnet_nodes = sorted(found_serials)
+    cn_modules_paths = {found_serials[node]: f'{cip_path}/{node}' for node in found_controlnet_nodes}
     cn_node_updt('--')
-    # print('-'*20)
-    # pprint(cn_modules_paths)
     return found_controlnet_nodes, cn_modules_paths
 
 
@@ -0,0 +1,311 @@
+"""
+What changed between scans: diff of the snapshots in scan history (see snapshot_history),
+and of the snapshot files older versions kept in prev/{system}.{YYYYMMDD_HHMM}.data
+
+Modules are matched by serial first, then by path:
+    added       serial (or serial-less module) not in the old snapshot
+    removed     serial (or serial-less module) not in the new snapshot
+    moved       same serial at another path
+    replaced    other serial at the path of a removed one (swapped card)
+    firmware    same serial, other revision
+
+Every snapshot has a digest of its modules, in its history record or in an index next to prev/ files,
+so a system whose latest snapshot equals the previous one is skipped without loading either.
+
+    python snapshot_diff.py                        latest scan against the previous one, all systems
+    python snapshot_diff.py --system Line1         one system
+    python snapshot_diff.py --baseline 20250101_0000   latest scan against the last one before the baseline
+    python snapshot_diff.py old.data new.data      two snapshot files
+"""
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+
+import numpy as np
+
+from global_data import global_data_cls, COLUMN_PREFIX, modules_to_columns
+from saver import get_user_data_path
+from snapshot_history import SnapshotHistory, list_histories
+
+SNAPSHOT_SUFFIX = '.data'
+EMPTY_SLOT = 'Empty slot'
+CHANGE_KINDS = ('added', 'removed', 'moved', 'replaced', 'firmware')
+
+
+def prev_path():
+    return get_user_data_path() / 'prev'
+
+
+def parse_snapshot_name(fname: str):
+    """'Line.1.20250101_1200.data' --> ('Line.1', '20250101_1200'), None if not a snapshot name"""
+    name = os.path.basename(fname)
+    if not name.endswith(SNAPSHOT_SUFFIX):
+        return None
+    system_name, _, stamp = name[:-len(SNAPSHOT_SUFFIX)].rpartition('.')
+    if not system_name or len(stamp) != 13 or not stamp.replace('_', '').isdigit():
+        return None
+    return system_name, stamp
+
+
+def list_snapshots(path=None, system_name: str = None) -> dict:
+    """{system name: [(stamp, file name), ...] oldest first} in one pass over the directory"""
+    path = path or prev_path()
+    snapshots = {}
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return snapshots
+    for entry in entries:
+        parsed = parse_snapshot_name(entry.name)
+        if parsed is None or (system_name is not None and parsed[0] != system_name):
+            continue
+        snapshots.setdefault(parsed[0], []).append((parsed[1], entry.path))
+    for history in snapshots.values():
+        history.sort()
+    return snapshots
+
+
+def _revision(major, minor):
+    if major is None or minor is None or np.isnan(major) or np.isnan(minor):
+        return None
+    return f'{int(major)}.{int(minor)}'
+
+
+def snapshot_modules(columns: dict) -> dict:
+    """
+    {path: (serial, revision, product name)} of columns as global_data_cls.restore_columns returns.
+    Empty slots are left out, the diff is about modules.
+    """
+    def column(name, default=''):
+        return columns.get(COLUMN_PREFIX + name, np.full(len(columns['key']), default))
+
+    modules = {}
+    for path, serial, major, minor, product_name in zip(column('path'), column('serial'), column('major', np.nan),
+                                                         column('minor', np.nan), column('product_name')):
+        if product_name == EMPTY_SLOT:
+            continue
+        modules[str(path)] = (str(serial), _revision(major, minor), str(product_name))
+    return modules
+
+
+def modules_digest(modules: dict) -> str:
+    """Equal for snapshots with the same modules at the same paths with the same revisions"""
+    digest = hashlib.sha1()
+    for path in sorted(modules):
+        digest.update(repr((path, *modules[path])).encode())
+    return digest.hexdigest()
+
+
+def load_modules(fname, allow_legacy: bool = False) -> dict:
+    """:param allow_legacy: read pickled snapshot of old version too. Only for the user's own files"""
+    return snapshot_modules(global_data_cls().restore_columns(fname, allow_legacy))
+
+
+class DigestIndex(object):
+    """
+    Digests of snapshot files, {file name: (mtime, size, digest)}. Pickled next to the snapshots.
+    A digest is computed once per file, rewritten files (other mtime or size) get a new one.
+    """
+
+    def __init__(self, fname=None):
+        self._fname = fname or prev_path() / 'digests.pkl'
+        self.digests = {}
+        self._changed = False
+
+    def load(self):
+        try:
+            with open(self._fname, 'rb') as file:
+                self.digests = pickle.load(file)
+        except FileNotFoundError:
+            pass
+        except (pickle.PickleError, EOFError) as e:
+            print(f"Broken snapshot digest index {self._fname}: {e}")
+        return self
+
+    def save(self):
+        if not self._changed:
+            return
+        os.makedirs(os.path.dirname(self._fname), exist_ok=True)
+        tmp_fname = f'{self._fname}.tmp'
+        with open(tmp_fname, 'wb') as file:
+            pickle.dump(self.digests, file)
+        os.replace(tmp_fname, self._fname)
+        self._changed = False
+
+    def digest(self, fname, modules: dict = None) -> str:
+        """Digest of the snapshot file. modules: already loaded modules of it, not to load them again"""
+        stat = os.stat(fname)
+        name = os.path.basename(fname)
+        known = self.digests.get(name)
+        if known and known[0] == stat.st_mtime and known[1] == stat.st_size:
+            return known[2]
+        digest = modules_digest(modules if modules is not None else load_modules(fname))
+        self.digests[name] = (stat.st_mtime, stat.st_size, digest)
+        self._changed = True
+        return digest
+
+    def prune(self, existing_names):
+        """Forget digests of snapshot files which are gone"""
+        existing_names = set(existing_names)
+        for name in [name for name in self.digests if name not in existing_names]:
+            del self.digests[name]
+            self._changed = True
+
+
+def diff_modules(old: dict, new: dict) -> dict:
+    """
+    Changes between two {path: (serial, revision, product name)}.
+    :return: {'added': [(path, serial, revision, product name)], 'removed': [...],
+              'moved': [(old path, new path, serial, product name)],
+              'replaced': [(path, old serial, new serial, old product name, new product name)],
+              'firmware': [(path, serial, old revision, new revision, product name)]}
+    """
+    changes = {kind: [] for kind in CHANGE_KINDS}
+    old_by_serial = {module[0]: path for path, module in old.items() if module[0]}
+    new_by_serial = {module[0]: path for path, module in new.items() if module[0]}
+
+    for serial, new_path in new_by_serial.items():
+        old_path = old_by_serial.get(serial)
+        if old_path is None:
+            continue
+        _, old_rev, _ = old[old_path]
+        _, new_rev, product_name = new[new_path]
+        if old_path != new_path:
+            changes['moved'].append((old_path, new_path, serial, product_name))
+        if old_rev != new_rev:
+            changes['firmware'].append((new_path, serial, old_rev, new_rev, product_name))
+
+    removed = {path: old[path] for path in old
+               if (old[path][0] and old[path][0] not in new_by_serial) or (not old[path][0] and old[path] != new.get(path))}
+    added = {path: new[path] for path in new
+             if (new[path][0] and new[path][0] not in old_by_serial) or (not new[path][0] and new[path] != old.get(path))}
+    for path in sorted(set(added) & set(removed)):
+        old_serial, _, old_name = removed.pop(path)
+        new_serial, _, new_name = added.pop(path)
+        changes['replaced'].append((path, old_serial, new_serial, old_name, new_name))
+    changes['added'] = [(path, *module) for path, module in sorted(added.items())]
+    changes['removed'] = [(path, *module) for path, module in sorted(removed.items())]
+    return changes
+
+
+def diff_snapshots(old_fname, new_fname, index: DigestIndex = None):
+    """Changes from old snapshot file to the new one, None if they hold the same modules"""
+    if index is not None and index.digest(old_fname) == index.digest(new_fname):
+        return None
+    old, new = load_modules(old_fname), load_modules(new_fname)
+    if index is None and modules_digest(old) == modules_digest(new):
+        return None
+    return diff_modules(old, new)
+
+
+def _compared(snapshots: list, baseline: str = None):
+    """(older, latest) of [(stamp, ...), ...] oldest first, None if nothing to compare"""
+    if not snapshots:
+        return None
+    latest = snapshots[-1]
+    if baseline is None:
+        older = snapshots[-2] if len(snapshots) > 1 else None
+    else:
+        older = next((snapshot for snapshot in reversed(snapshots) if snapshot[0] < baseline), None)
+    if older is None or older == latest:
+        return None
+    return older, latest
+
+
+def diff_history(history: SnapshotHistory, old_stamp: str, new_stamp: str) -> dict:
+    """Changes between two snapshots of the history"""
+    old, new = (snapshot_modules(modules_to_columns(*history.snapshot(stamp))) for stamp in (old_stamp, new_stamp))
+    return diff_modules(old, new)
+
+
+def diff_latest(path=None, system_name: str = None, baseline: str = None, index: DigestIndex = None,
+                history_path=None) -> dict:
+    """
+    Latest snapshot of every system against the previous one, or against the last one taken before baseline.
+    Systems with a single snapshot or without changes are left out.
+    prev/ files are compared only for systems not in scan history yet.
+    :param baseline: stamp YYYYMMDD_HHMM
+    :return: {system name: changes as diff_modules returns}
+    """
+    changed = {}
+    histories = list_histories(history_path)
+    for name, fname in sorted(histories.items()):
+        if system_name is not None and name != system_name:
+            continue
+        history = SnapshotHistory(name, fname)
+        compared = _compared(history.stamps(), baseline)
+        if compared is None or compared[0][1] == compared[1][1]:  # same digest
+            continue
+        changes = diff_history(history, compared[0][0], compared[1][0])
+        if any(changes.values()):
+            changed[name] = changes
+
+    own_index = index is None
+    if own_index:
+        index = DigestIndex(os.path.join(path, 'digests.pkl') if path else None).load()
+    snapshots = list_snapshots(path, system_name)
+    for name, history in sorted(snapshots.items()):
+        compared = None if name in histories else _compared(history, baseline)
+        if compared is None:
+            continue
+        try:
+            changes = diff_snapshots(compared[0][1], compared[1][1], index)
+        except ValueError as e:  # pickled snapshot of old version
+            print(f"{e}. Move it into history: python snapshot_history.py migrate")
+            continue
+        if changes is not None and any(changes.values()):
+            changed[name] = changes
+    if own_index:
+        if system_name is None:
+            index.prune(os.path.basename(fname) for history in snapshots.values() for _, fname in history)
+        index.save()
+    return changed
+
+
+def format_changes(system_name: str, changes: dict) -> str:
+    lines = [system_name]
+    for path, serial, rev, product_name in changes['added']:
+        lines.append(f'  + {path:<24} {product_name} sn {serial} rev {rev}')
+    for path, serial, rev, product_name in changes['removed']:
+        lines.append(f'  - {path:<24} {product_name} sn {serial} rev {rev}')
+    for path, old_serial, new_serial, old_name, new_name in changes['replaced']:
+        lines.append(f'  * {path:<24} {old_name} sn {old_serial} --> {new_name} sn {new_serial}')
+    for old_path, new_path, serial, product_name in changes['moved']:
+        lines.append(f'  > {old_path} --> {new_path}  {product_name} sn {serial}')
+    for path, serial, old_rev, new_rev, product_name in changes['firmware']:
+        lines.append(f'  ~ {path:<24} {product_name} sn {serial} rev {old_rev} --> {new_rev}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Modules changed between scans")
+    parser.add_argument('snapshots', nargs='*', help="old and new snapshot files. Default: latest scans in prev/")
+    parser.add_argument('--system', help="only this system")
+    parser.add_argument('--baseline', help="compare with the last scan before YYYYMMDD_HHMM")
+    parser.add_argument('--prev', help="snapshot directory of old versions (default: user data prev/)")
+    parser.add_argument('--history', help="scan history directory (default: user data history/)")
+    args = parser.parse_args(argv)
+
+    if args.snapshots:
+        if len(args.snapshots) != 2:
+            parser.error("give two snapshot files: old and new")
+        try:
+            changes = diff_snapshots(*args.snapshots)
+        except ValueError as e:
+            parser.error(str(e))
+        changed = {f'{args.snapshots[0]} --> {args.snapshots[1]}': changes} if changes and any(changes.values()) else {}
+    else:
+        changed = diff_latest(args.prev, args.system, args.baseline, history_path=args.history)
+
+    if not changed:
+        print("No changes")
+        return 0
+    for name, changes in changed.items():
+        print(format_changes(name, changes))
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
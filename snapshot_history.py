@@ -0,0 +1,317 @@
+"""
+Scan history of a system as one file: a base snapshot and per-scan deltas of changed module records.
+Replaces a full copy of the system per scan in prev/.
+
+history/{system}.history holds one JSON record per line, stamp (YYYYMMDD_HHMM UTC) and digest first:
+    {"stamp": ..., "digest": ..., "kind": "base", "modules": {system path: module}, "cn_nodes": [...]}
+    {"stamp": ..., "digest": ..., "kind": "delta", "set": {system path: module}, "del": [system path, ...],
+     "cn_nodes": [...]}                   cn_nodes only if they changed
+Any snapshot is rebuilt by replaying deltas over the last base before it. Every rebase_every deltas a new
+base is written, so that replay stays short. Retention drops snapshots and compacts the file.
+
+    python snapshot_history.py list Line1
+    python snapshot_history.py export Line1 20250101_1200 Line1.data
+    python snapshot_history.py prune --hourly 24 --daily 31 --monthly 24
+    python snapshot_history.py migrate          moves prev/{system}.{stamp}.data snapshots into history
+"""
+import argparse
+import json
+import os
+import pickle
+import re
+import sys
+
+from global_data import global_data_cls, column_value, modules_to_columns
+from saver import get_user_data_path
+
+HISTORY_SUFFIX = '.history'
+_HEADER = re.compile(r'\{"stamp": "([^"]*)", "digest": "([^"]*)", "kind": "(base|delta)"')
+
+
+def history_path():
+    return get_user_data_path() / 'history'
+
+
+def list_histories(path=None) -> dict:
+    """{system name: history file name}"""
+    path = path or history_path()
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return {}
+    return {entry.name[:-len(HISTORY_SUFFIX)]: entry.path for entry in entries if entry.name.endswith(HISTORY_SUFFIX)}
+
+
+def snapshot_digest(modules: dict, cn_nodes: list) -> str:
+    """Same digest snapshot_diff gives to the snapshot file of these modules"""
+    import snapshot_diff
+    return snapshot_diff.modules_digest(snapshot_diff.snapshot_modules(modules_to_columns(modules, cn_nodes)))
+
+
+class RetentionPolicy(object):
+    """
+    Which snapshots to keep: the latest one of each of the last `hourly` hours, `daily` days and
+    `monthly` months that have snapshots. The latest snapshot is always kept. Pickled in user data.
+    """
+
+    def __init__(self, hourly: int = 24, daily: int = 31, monthly: int = 24, fname=None):
+        self.hourly = hourly
+        self.daily = daily
+        self.monthly = monthly
+        self._fname = fname or get_user_data_path() / 'retention.pkl'
+
+    def keep(self, stamps) -> set:
+        stamps = sorted(stamps, reverse=True)
+        kept = set(stamps[:1])
+        for bucket_len, count in ((11, self.hourly), (8, self.daily), (6, self.monthly)):  # YYYYMMDD_HH, YYYYMMDD, YYYYMM
+            buckets = set()
+            for stamp in stamps:
+                if len(buckets) >= count:
+                    break
+                bucket = stamp[:bucket_len]
+                if bucket not in buckets:
+                    buckets.add(bucket)
+                    kept.add(stamp)
+        return kept
+
+    def load(self):
+        try:
+            with open(self._fname, 'rb') as file:
+                self.hourly, self.daily, self.monthly = pickle.load(file)
+        except FileNotFoundError:
+            pass
+        except (pickle.PickleError, EOFError, ValueError) as e:
+            print(f"Broken retention policy {self._fname}: {e}")
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self._fname), exist_ok=True)
+        with open(self._fname, 'wb') as file:
+            pickle.dump((self.hourly, self.daily, self.monthly), file)
+
+
+class SnapshotHistory(object):
+    """Snapshots of one system, see the module docstring for the file format"""
+
+    def __init__(self, system_name: str, fname=None, rebase_every: int = 50):
+        self.system_name = system_name
+        self._fname = fname or history_path() / f'{system_name}{HISTORY_SUFFIX}'
+        self.rebase_every = rebase_every
+
+    def exists(self) -> bool:
+        return os.path.exists(self._fname)
+
+    def _lines(self):
+        try:
+            file = open(self._fname, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with file:
+            yield from file
+
+    def records(self):
+        """Yields records oldest first. A torn last line (power loss) is skipped"""
+        for line in self._lines():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Broken record in {self._fname} skipped")
+
+    def stamps(self) -> list:
+        """[(stamp, digest), ...] oldest first, without parsing the module records"""
+        stamps = []
+        for line in self._lines():
+            header = _HEADER.match(line)
+            if header and line.endswith('\n'):
+                stamps.append((header[1], header[2]))
+        return stamps
+
+    def _replay(self, until: str = None):
+        """Snapshot at stamp until (latest if None): (modules, cn_nodes, deltas since base), None if no such"""
+        state = None
+        for record in self.records():
+            if until is not None and record['stamp'] > until:
+                break
+            if record['kind'] == 'base':
+                state = [dict(record['modules']), record['cn_nodes'], 0]
+            elif state is not None:
+                modules = state[0]
+                for key in record['del']:
+                    modules.pop(key, None)
+                modules.update(record['set'])
+                if 'cn_nodes' in record:
+                    state[1] = record['cn_nodes']
+                state[2] += 1
+            state_stamp = record['stamp']
+        if state is None or (until is not None and state_stamp != until):
+            return None
+        return state
+
+    def snapshot(self, stamp: str = None):
+        """(modules {system path: module}, cn_nodes) at stamp, latest if None. None if no such snapshot"""
+        state = self._replay(stamp)
+        return None if state is None else (state[0], state[1])
+
+    def restore(self, saver: global_data_cls, stamp: str = None) -> global_data_cls:
+        """Fills saver with the snapshot, to store it as .data file"""
+        saver.module, saver.cn_nodes = self.snapshot(stamp)
+        return saver
+
+    @staticmethod
+    def _normalized(modules: dict) -> dict:
+        """Modules as they read back from JSON, so equal modules compare equal"""
+        return json.loads(json.dumps(modules, default=column_value))
+
+    def append(self, stamp: str, modules: dict, cn_nodes: list):
+        """
+        Adds snapshot of a scan. Snapshot of the same stamp (scan in the same minute) is replaced.
+        Returns False if history has a later snapshot already (clock went back), then nothing is added
+        """
+        stamps = [s for s, _ in self.stamps()]
+        if stamps and stamps[-1] > stamp:
+            print(f"History of {self.system_name} has snapshots later than {stamp}. Snapshot not added")
+            return False
+        if stamps and stamps[-1] == stamp:
+            stamps.pop()
+            self.compact(stamps)
+        modules = self._normalized(modules)
+        cn_nodes = self._normalized(cn_nodes)
+        digest = snapshot_digest(modules, cn_nodes)
+        previous = self._replay(stamps[-1]) if stamps else None
+
+        record = {'stamp': stamp, 'digest': digest}
+        if previous is None or previous[2] + 1 >= self.rebase_every:
+            record.update(kind='base', modules=modules, cn_nodes=cn_nodes)
+        else:
+            old_modules, old_cn_nodes, _ = previous
+            record.update(kind='delta',
+                          set={key: module for key, module in modules.items() if old_modules.get(key) != module},
+                          **{'del': [key for key in old_modules if key not in modules]})
+            if cn_nodes != old_cn_nodes:
+                record['cn_nodes'] = cn_nodes
+        os.makedirs(os.path.dirname(self._fname), exist_ok=True)
+        with open(self._fname, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(record) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        return True
+
+    def compact(self, keep):
+        """Rewrites history with only the snapshots of stamps in keep. The oldest kept one becomes the base"""
+        keep = set(keep)
+        kept = []
+        state = None
+        for record in self.records():
+            if record['kind'] == 'base':
+                state = [dict(record['modules']), record['cn_nodes']]
+            elif state is not None:
+                for key in record['del']:
+                    state[0].pop(key, None)
+                state[0].update(record['set'])
+                if 'cn_nodes' in record:
+                    state[1] = record['cn_nodes']
+            if state is not None and record['stamp'] in keep:
+                kept.append((record['stamp'], record['digest'], dict(state[0]), state[1]))
+
+        tmp_fname = f'{self._fname}.tmp'
+        os.makedirs(os.path.dirname(self._fname), exist_ok=True)
+        with open(tmp_fname, 'w', encoding='utf-8') as file:
+            previous = None
+            for since_base, (stamp, digest, modules, cn_nodes) in enumerate(kept):
+                record = {'stamp': stamp, 'digest': digest}
+                if previous is None or since_base % self.rebase_every == 0:
+                    record.update(kind='base', modules=modules, cn_nodes=cn_nodes)
+                else:
+                    old_modules, old_cn_nodes = previous
+                    record.update(kind='delta',
+                                  set={key: module for key, module in modules.items() if old_modules.get(key) != module},
+                                  **{'del': [key for key in old_modules if key not in modules]})
+                    if cn_nodes != old_cn_nodes:
+                        record['cn_nodes'] = cn_nodes
+                file.write(json.dumps(record) + '\n')
+                previous = (modules, cn_nodes)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_fname, self._fname)
+
+    def apply_retention(self, policy: RetentionPolicy) -> int:
+        """Drops snapshots the policy does not keep. Returns number of snapshots dropped"""
+        stamps = [stamp for stamp, _ in self.stamps()]
+        keep = policy.keep(stamps)
+        dropped = len(stamps) - len(keep)
+        if dropped:
+            self.compact(keep)
+        return dropped
+
+
+def migrate_prev(prev_path=None, path=None, remove: bool = True) -> int:
+    """
+    Moves snapshot files prev/{system}.{stamp}.data into histories, oldest first.
+    A file is removed only after its snapshot reads back from history with the same digest.
+    Returns number of snapshots moved
+    """
+    import snapshot_diff
+    moved = 0
+    for system_name, snapshots in snapshot_diff.list_snapshots(prev_path).items():
+        history = SnapshotHistory(system_name, os.path.join(path, f'{system_name}{HISTORY_SUFFIX}') if path else None)
+        known = {stamp for stamp, _ in history.stamps()}
+        for stamp, fname in snapshots:
+            if stamp not in known:
+                if known and stamp < max(known):
+                    print(f"{fname} is older than history of {system_name}. Left in place")
+                    continue
+                saver = global_data_cls()
+                saver.restore_data(fname, allow_legacy=True)  # own prev/ files of old versions
+                history.append(stamp, saver.module, saver.cn_nodes)
+                known.add(stamp)
+            modules, cn_nodes = history.snapshot(stamp)
+            if snapshot_digest(modules, cn_nodes) != snapshot_diff.modules_digest(snapshot_diff.load_modules(fname, allow_legacy=True)):
+                print(f"{fname} does not match its history record. Left in place")
+                continue
+            moved += 1
+            if remove:
+                os.remove(fname)
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshot history of scanned systems")
+    commands = parser.add_subparsers(dest='command', required=True)
+    list_parser = commands.add_parser('list', help="snapshots of a system")
+    list_parser.add_argument('system')
+    export_parser = commands.add_parser('export', help="rebuild a snapshot as .data file")
+    export_parser.add_argument('system')
+    export_parser.add_argument('stamp', help="YYYYMMDD_HHMM as 'list' shows")
+    export_parser.add_argument('file')
+    prune_parser = commands.add_parser('prune', help="apply retention policy to all histories")
+    policy = RetentionPolicy().load()
+    prune_parser.add_argument('--hourly', type=int, default=policy.hourly, help=f"default: {policy.hourly}")
+    prune_parser.add_argument('--daily', type=int, default=policy.daily, help=f"default: {policy.daily}")
+    prune_parser.add_argument('--monthly', type=int, default=policy.monthly, help=f"default: {policy.monthly}")
+    prune_parser.add_argument('--save', action='store_true', help="keep this policy for scans to apply")
+    commands.add_parser('migrate', help="move prev/ snapshot files into histories")
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for stamp, digest in SnapshotHistory(args.system).stamps():
+            print(f'{stamp}  {digest}')
+    elif args.command == 'export':
+        history = SnapshotHistory(args.system)
+        if history.snapshot(args.stamp) is None:
+            print(f"No snapshot {args.stamp} of {args.system}")
+            return 1
+        history.restore(global_data_cls(), args.stamp).store_data(filename=args.file)
+    elif args.command == 'prune':
+        policy.hourly, policy.daily, policy.monthly = args.hourly, args.daily, args.monthly
+        if args.save:
+            policy.save()
+        for system_name in sorted(list_histories()):
+            dropped = SnapshotHistory(system_name).apply_retention(policy)
+            print(f"{system_name:<30} {dropped:>6} snapshots dropped")
+    elif args.command == 'migrate':
+        print(f"{migrate_prev()} snapshots moved to {history_path()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# Known topology of scanned systems, kept between runs for quick rescans
+import os
+import pickle
+import tempfile
+
+from saver import get_user_data_path
+
+
+class TopologyCache(object):
+    """
+    Topology of one system found by the last successful scan.
+
+    Attributes:
+        backplanes (dict): {backplane serial: {'path': cip_path, 'size': slots, 'slots': {slot: module serial}}}
+                           only populated slots are listed
+        bridges (dict): {ControlNet bridge serial: {'path': cip_path, 'nodes': {node: module serial}}}
+    """
+
+    def __init__(self, system_name: str, fname=None):
+        self._fname = fname or get_user_data_path() / 'topology' / f'{system_name}.topology'
+        self.backplanes = {}
+        self.bridges = {}
+        self._seen = set()  # serials of backplanes and bridges updated since load
+
+    def update_backplane(self, serial: str, cip_path: str, size, modules_in_bp: dict):
+        self._seen.add(serial)
+        self.backplanes[serial] = {
+            'path': cip_path,
+            'size': size,
+            'slots': {slot: sn for slot, sn in modules_in_bp.items() if sn},
+        }
+
+    def update_bridge(self, serial: str, cip_path: str, cn_modules_paths: dict):
+        """cn_modules_paths as scan_cn returns: {module serial: f'{cip_path}/{node}'}"""
+        self._seen.add(serial)
+        self.bridges[serial] = {
+            'path': cip_path,
+            'nodes': {int(path.rsplit('/', 1)[1]): sn for sn, path in cn_modules_paths.items()},
+        }
+
+    def known_slots(self) -> dict:
+        """{backplane serial: {slot: module serial}}"""
+        return {serial: bp['slots'] for serial, bp in self.backplanes.items()}
+
+    def known_nodes(self, bridge_serial: str):
+        """{node: module serial} of ControlNet behind the bridge, None if not known"""
+        bridge = self.bridges.get(bridge_serial)
+        return None if bridge is None else bridge['nodes']
+
+    def prune(self):
+        """Drops backplanes and bridges not updated since load. Only a full scan sees all that is there"""
+        self.backplanes = {serial: bp for serial, bp in self.backplanes.items() if serial in self._seen}
+        self.bridges = {serial: bridge for serial, bridge in self.bridges.items() if serial in self._seen}
+
+    def save(self):
+        """File is replaced at once, an interrupted save leaves the previous cache"""
+        directory = os.path.dirname(self._fname)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_fname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump({'backplanes': self.backplanes, 'bridges': self.bridges}, file)
+            os.replace(tmp_fname, self._fname)
+        except BaseException:
+            os.remove(tmp_fname)
+            raise
+
+    def load(self):
+        """Loads cache if exists. Broken or missing cache means full scan"""
+        try:
+            with open(self._fname, 'rb') as file:
+                data = pickle.load(file)
+            self.backplanes = data['backplanes']
+            self.bridges = data['bridges']
+        except FileNotFoundError:
+            pass
+        except (pickle.PickleError, EOFError, KeyError) as e:
+            print(f"Broken topology cache {self._fname}: {e}")
+        return self